@@ -197,14 +197,49 @@ class AccountBankingMandate(models.Model):
                           "attached to a bank account.") %
                         mandate.unique_mandate_reference)
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        vals_to_name = [
+            vals for vals in vals_list
+            if vals.get('unique_mandate_reference', 'New') in (
+                'New', False, '')]
+        references = self.env['ir.sequence'].next_by_code_batch(
+            'account.banking.mandate', len(vals_to_name))
+        for vals, reference in zip(vals_to_name, references):
+            vals['unique_mandate_reference'] = reference or 'New'
+        return super(AccountBankingMandate, self).create(vals_list)
+
     @api.model
-    def create(self, vals=None):
-        unique_mandate_reference = vals.get('unique_mandate_reference')
-        if not unique_mandate_reference or unique_mandate_reference == 'New':
-            vals['unique_mandate_reference'] = \
-                self.env['ir.sequence'].next_by_code(
-                    'account.banking.mandate') or 'New'
-        return super(AccountBankingMandate, self).create(vals)
+    def _get_valid_mandate_index(
+            self, partner_bank_ids=None, partner_ids=None, company=None):
+        """Fetch the valid mandates of several bank accounts and partners
+        in one query
+        @param partner_bank_ids: ids of res.partner.bank
+        @param partner_ids: ids of res.partner
+        @param company: if set, only the mandates of this company are used
+        @return: tuple of dicts (mandate per bank account id, mandate per
+            partner id), the mandate being the first one in the
+            'signature_date desc' order, the most recent one for a same
+            signature date
+        """
+        mandates_per_bank = {}
+        mandates_per_partner = {}
+        partner_bank_ids = list(partner_bank_ids or [])
+        partner_ids = list(partner_ids or [])
+        if not partner_bank_ids and not partner_ids:
+            return mandates_per_bank, mandates_per_partner
+        domain = [
+            ('state', '=', 'valid'),
+            '|',
+            ('partner_bank_id', 'in', partner_bank_ids),
+            ('partner_id', 'in', partner_ids)]
+        if company:
+            domain.append(('company_id', '=', company.id))
+        mandates = self.search(domain, order='signature_date desc, id desc')
+        for mandate in mandates:
+            mandates_per_bank.setdefault(mandate.partner_bank_id.id, mandate)
+            mandates_per_partner.setdefault(mandate.partner_id.id, mandate)
+        return mandates_per_bank, mandates_per_partner
 
     @api.multi
     @api.onchange('partner_bank_id')
@@ -18,24 +18,60 @@ class AccountMoveLine(models.Model):
     def _prepare_payment_line_vals(self, payment_order):
         vals = super(AccountMoveLine, self)._prepare_payment_line_vals(
             payment_order)
+        # In _prepare_payment_lines_vals(), the mandates of all the lines
+        # are set at once afterwards
+        if not self.env.context.get('payment_lines_vals_batch'):
+            self._set_payment_lines_vals_mandate(payment_order, [vals])
+        return vals
+
+    @api.multi
+    def _prepare_payment_lines_vals(self, payment_order):
+        vals_list = super(AccountMoveLine, self.with_context(
+            payment_lines_vals_batch=True))._prepare_payment_lines_vals(
+                payment_order)
+        self._set_payment_lines_vals_mandate(payment_order, vals_list)
+        return vals_list
+
+    @api.multi
+    def _set_payment_lines_vals_mandate(self, payment_order, vals_list):
+        """Set the mandate and its bank account in the values of the
+        payment lines of the move lines, searching the valid mandates of
+        the lines without one at once
+        @param vals_list: list of the values of the payment lines, in the
+            order of the move lines, updated in place
+        """
         if payment_order.payment_type != 'inbound':
-            return vals
-        mandate = self.mandate_id
-        if not mandate and vals.get('mandate_id', False):
-            mandate = mandate.browse(vals['mandate_id'])
-        partner_bank_id = vals.get('partner_bank_id', False)
-        if not mandate:
-            if partner_bank_id:
-                domain = [('partner_bank_id', '=', partner_bank_id)]
+            return
+        mandate_model = self.env['account.banking.mandate']
+        bank_ids = set()
+        partner_ids = set()
+        for mline, vals in zip(self, vals_list):
+            if mline.mandate_id or vals.get('mandate_id'):
+                continue
+            if vals.get('partner_bank_id'):
+                bank_ids.add(vals['partner_bank_id'])
             else:
-                domain = [('partner_id', '=', self.partner_id.id)]
-            domain.append(('state', '=', 'valid'))
-            mandate = mandate.search(domain, limit=1)
-        vals.update({
-            'mandate_id': mandate.id,
-            'partner_bank_id': mandate.partner_bank_id.id or partner_bank_id,
-        })
-        return vals
+                partner_ids.add(mline.partner_id.id)
+        mandates_per_bank, mandates_per_partner = \
+            mandate_model._get_valid_mandate_index(
+                partner_bank_ids=bank_ids, partner_ids=partner_ids)
+        for mline, vals in zip(self, vals_list):
+            mandate = mline.mandate_id
+            if not mandate and vals.get('mandate_id', False):
+                mandate = mandate.browse(vals['mandate_id'])
+            partner_bank_id = vals.get('partner_bank_id', False)
+            if not mandate:
+                if partner_bank_id:
+                    mandate = mandates_per_bank.get(
+                        partner_bank_id, mandate_model)
+                else:
+                    mandate = mandates_per_partner.get(
+                        mline.partner_id.id, mandate_model)
+            vals.update({
+                'mandate_id': mandate.id,
+                'partner_bank_id':
+                    mandate.partner_bank_id.id or partner_bank_id,
+            })
 
     @api.multi
     @api.constrains('mandate_id', 'company_id')
@@ -28,23 +28,17 @@ class ResPartner(models.Model):
 
     @api.multi
     def _compute_valid_mandate_id(self):
-        # Dict for reducing the duplicated searches on parent/child partners
         company_id = self.env.context.get('force_company', False)
         if company_id:
             company = self.env['res.company'].browse(company_id)
         else:
             company = self.env['res.company']._company_default_get(
                 'account.banking.mandate')
-
-        mandates_dic = {}
+        # The mandates of all the commercial partners are fetched at once
+        mandates_per_partner = self.env['account.banking.mandate'].\
+            _get_valid_mandate_index(
+                partner_ids=self.mapped('commercial_partner_id').ids,
+                company=company)[1]
         for partner in self:
-            commercial_partner_id = partner.commercial_partner_id.id
-            if commercial_partner_id in mandates_dic:
-                partner.valid_mandate_id = mandates_dic[commercial_partner_id]
-            else:
-                mandates = partner.commercial_partner_id.bank_ids.mapped(
-                    'mandate_ids').filtered(
-                    lambda x: x.state == 'valid' and x.company_id == company)
-                first_valid_mandate_id = mandates[:1].id
-                partner.valid_mandate_id = first_valid_mandate_id
-                mandates_dic[commercial_partner_id] = first_valid_mandate_id
+            partner.valid_mandate_id = mandates_per_partner.get(
+                partner.commercial_partner_id.id)
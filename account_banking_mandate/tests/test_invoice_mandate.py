@@ -66,6 +66,24 @@ class TestInvoiceMandate(TransactionCase):
         self.assertEqual(self.invoice.mandate_id, self.mandate)
         self.invoice.refund()
 
+    def test_prepare_payment_line_vals(self):
+        self.invoice._onchange_partner_id()
+        self.invoice.action_invoice_open()
+        move_line = self.invoice.move_id.line_ids.filtered(
+            lambda s: s.account_id == self.invoice_account)
+        # The valid mandate of the bank account is looked up
+        move_line.mandate_id = False
+        payment_order = self.env['account.payment.order'].create({
+            'payment_type': 'inbound',
+            'payment_mode_id': self.mode_inbound_acme.id,
+        })
+        vals = move_line._prepare_payment_line_vals(payment_order)
+        self.assertEqual(vals['mandate_id'], self.mandate.id)
+        self.assertEqual(
+            vals['partner_bank_id'], self.mandate.partner_bank_id.id)
+        self.assertEqual(
+            move_line._prepare_payment_lines_vals(payment_order), [vals])
+
     def test_onchange_partner(self):
         partner_2 = self._create_res_partner('Jane with ACME Bank')
         partner_2.customer_payment_mode_id = self.mode_inbound_acme
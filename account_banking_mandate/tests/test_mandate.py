@@ -24,6 +24,47 @@ class TestMandate(TransactionCase):
         mandate.back2draft()
         self.assertEqual(mandate.state, 'draft')
 
+    def test_mandate_create_multi(self):
+        bank_account = self.env.ref('account_payment_mode.res_partner_12_iban')
+        mandates = self.env['account.banking.mandate'].create([{
+            'partner_bank_id': bank_account.id,
+            'signature_date': '2015-01-01',
+            'company_id': self.company.id,
+            }, {
+            'partner_bank_id': bank_account.id,
+            'signature_date': '2015-01-01',
+            'company_id': self.company.id,
+            'unique_mandate_reference': 'MANUAL-REF',
+            }, {
+            'partner_bank_id': bank_account.id,
+            'signature_date': '2015-01-01',
+            'company_id': self.company.id,
+            }])
+        references = mandates.mapped('unique_mandate_reference')
+        self.assertEqual(references[1], 'MANUAL-REF')
+        self.assertNotEqual(references[0], 'New')
+        self.assertNotEqual(references[0], references[2])
+
+    def test_valid_mandate_index(self):
+        partner = self.env['res.partner'].create({'name': 'Mandate index'})
+        bank_account = self.env['res.partner.bank'].create({
+            'partner_id': partner.id,
+            'acc_number': 'FR7630004000031234567890143',
+        })
+        mandates = self.env['account.banking.mandate'].create([{
+            'partner_bank_id': bank_account.id,
+            'signature_date': signature_date,
+            'company_id': self.company.id,
+            } for signature_date in (
+                '2015-01-01', '2016-01-01', '2016-01-01')])
+        mandates.validate()
+        mandates_per_bank, mandates_per_partner = self.env[
+            'account.banking.mandate']._get_valid_mandate_index(
+                partner_bank_ids=bank_account.ids, partner_ids=partner.ids)
+        self.assertEqual(mandates_per_bank[bank_account.id], mandates[2])
+        self.assertEqual(mandates_per_partner[partner.id], mandates[2])
+        self.assertEqual(partner.valid_mandate_id, mandates[2])
+
     def test_mandate_02(self):
         bank_account = self.env.ref('account_payment_mode.res_partner_12_iban')
         mandate = self.env['account.banking.mandate'].create({
@@ -3,6 +3,11 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+import logging
+
+from .common import get_pain_schema
+
+logger = logging.getLogger(__name__)
 
 
 class AccountPaymentMethod(models.Model):
@@ -14,6 +19,34 @@ class AccountPaymentMethod(models.Model):
         help="If active, Odoo will convert each accented character to "
         "the corresponding unaccented character, so that only ASCII "
         "characters are used in the generated PAIN file.")
+    pain_streaming = fields.Boolean(
+        string='Stream XML Generation',
+        help="If active, each block of the PAIN file is written to a "
+        "temporary file as soon as it is generated, instead of building "
+        "the whole XML tree in memory. Recommended for payment orders "
+        "with tens of thousands of transactions.")
+    pain_validation = fields.Selection([
+        ('full', 'Full'),
+        ('sample', 'Sample of Payment Info Blocks'),
+        ], string='XML Validation', default='full', required=True,
+        help="Full: the whole PAIN file is validated against the official "
+        "XML Schema Definition. Sample: only the group header and some "
+        "payment info blocks, evenly spread over the file, are validated, "
+        "which is faster for very large files.")
+    pain_validation_sample_size = fields.Integer(
+        string='Validation Sample Size', default=10,
+        help="Number of payment info blocks validated when the XML "
+        "validation is done on a sample.")
+    pain_parallel_processes = fields.Integer(
+        string='Parallel Processes',
+        help="Number of processes rendering the transactions of the PAIN "
+        "file, forked from the background job generating it. With 2 or "
+        "more, the transactions are rendered from plain data. This is "
+        "not done when the file is generated by an HTTP request or by a "
+        "server running without workers, nor when "
+        "an installed module customizes the generation methods "
+        "(generate_party_block(), generate_remittance_info_block()...). "
+        "Leave 0 to render them in the current process.")
 
     @api.multi
     def get_xsd_file_path(self):
@@ -22,6 +55,19 @@ class AccountPaymentMethod(models.Model):
         raise UserError(_(
             "No XSD file path found for payment method '%s'") % self.name)
 
+    def _register_hook(self):
+        res = super(AccountPaymentMethod, self)._register_hook()
+        # Compile the XML Schemas when the registry is loaded, so that
+        # the first payment file of the worker doesn't pay for it
+        for method in self.search([('pain_version', '!=', False)]):
+            try:
+                get_pain_schema(method.get_xsd_file_path())
+            except Exception as e:
+                logger.warning(
+                    "Could not compile the XML Schema of payment method "
+                    "%s: %s", method.name, e)
+        return res
+
     _sql_constraints = [(
         # Extending this constraint from account_payment_mode
         'code_payment_type_unique',
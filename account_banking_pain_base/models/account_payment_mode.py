@@ -33,3 +33,12 @@ class AccountPaymentMode(models.Model):
         "the PAIN files generated by Odoo. This value is determined by the "
         "financial institution that will process the file. If not defined, "
         "no scheme will be used.\n")
+    pain_output_format = fields.Selection([
+        ('pretty', 'Indented XML'),
+        ('compact', 'Compact XML'),
+        ('gzip', 'Compact XML, compressed with gzip'),
+        ('zip', 'Compact XML, in a ZIP archive'),
+        ], string='PAIN File Format', default='pretty', required=True,
+        help="Compact XML files don't have any indentation, which makes "
+        "large files significantly smaller. Check that your bank accepts "
+        "compressed files before using gzip or ZIP.")
@@ -3,21 +3,32 @@
 # © 2016 Antiun Ingenieria S.L. - Antonio Espinosa
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
-from odoo import models, fields, api, _, tools
+from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-from odoo.tools.safe_eval import safe_eval
+from odoo.tools import config
 from datetime import datetime
 from lxml import etree
 import logging
 
-
-try:
-    from unidecode import unidecode
-except ImportError:
-    unidecode = None
+from .common import (
+    PainFragmentCache, compress_payment_file, convert_to_pain_ascii,
+    eval_expression, locked_pain_schema, parse_sampled_pain_file,
+    qualify_pain_tree, sampled_payment_info_blocks)
+from .pain_parallel import (
+    PARALLEL_CHUNK_SIZE, render_in_pool, render_transactions_job)
+from .pain_render import PainRenderError
+from .pain_snapshot import (
+    PainBankAccount, PainParty, PainTransaction)
+from .pain_writer import PainStreamWriter, PainTreeWriter
 
 logger = logging.getLogger(__name__)
 
+# Generation methods called by generate_party_block(): when a module
+# overrides one of them, the party block may depend on the bank line
+PARTY_BLOCK_HOOKS = (
+    'generate_party_agent', 'generate_party_acc_number',
+    'generate_address_block', 'generate_party_id', '_prepare_field')
+
 
 class AccountPaymentOrder(models.Model):
     _inherit = 'account.payment.order'
@@ -57,19 +68,49 @@ class AccountPaymentOrder(models.Model):
         'payment_line_ids.partner_bank_id.acc_type')
     def compute_sepa(self):
         eur = self.env.ref('base.EUR')
+        orders = self.filtered(
+            lambda order: order.company_partner_bank_id.acc_type == 'iban')
+        # The saved orders are checked with one grouped query on their
+        # lines, the bank accounts being then checked once for all orders
+        saved_orders = orders.filtered(
+            lambda order: not isinstance(order.id, models.NewId))
+        non_sepa_ids = set()
+        partner_bank_ids = {}
+        if saved_orders:
+            self._cr.execute("""
+                SELECT order_id,
+                    bool_or(currency_id != %s OR partner_bank_id IS NULL),
+                    array_agg(DISTINCT partner_bank_id)
+                FROM account_payment_line
+                WHERE order_id IN %s
+                GROUP BY order_id""", (eur.id, tuple(saved_orders.ids)))
+            for order_id, non_sepa, bank_ids in self._cr.fetchall():
+                if non_sepa:
+                    non_sepa_ids.add(order_id)
+                else:
+                    partner_bank_ids[order_id] = bank_ids
+        all_bank_ids = set()
+        for bank_ids in partner_bank_ids.values():
+            all_bank_ids.update(bank_ids)
+        non_iban_ids = set(
+            self.env['res.partner.bank'].browse(list(all_bank_ids)).filtered(
+                lambda bank: bank.acc_type != 'iban').ids)
+        for order_id, bank_ids in partner_bank_ids.items():
+            if non_iban_ids.intersection(bank_ids):
+                non_sepa_ids.add(order_id)
+        iban_order_ids = set(orders.ids)
+        saved_order_ids = set(saved_orders.ids)
         for order in self:
-            sepa = True
-            if order.company_partner_bank_id.acc_type != 'iban':
+            if order.id not in iban_order_ids:
                 sepa = False
-            for pline in order.payment_line_ids:
-                if pline.currency_id != eur:
-                    sepa = False
-                    break
-                if pline.partner_bank_id.acc_type != 'iban':
-                    sepa = False
-                    break
-            sepa = order.compute_sepa_final_hook(sepa)
-            self.sepa = sepa
+            elif order.id in saved_order_ids:
+                sepa = order.id not in non_sepa_ids
+            else:
+                sepa = all(
+                    pline.currency_id == eur and
+                    pline.partner_bank_id.acc_type == 'iban'
+                    for pline in order.payment_line_ids)
+            order.sepa = order.compute_sepa_final_hook(sepa)
 
     @api.multi
     def compute_sepa_final_hook(self, sepa):
@@ -84,19 +125,16 @@ class AccountPaymentOrder(models.Model):
             gen_args = {}
         assert isinstance(eval_ctx, dict), 'eval_ctx must contain a dict'
         try:
-            value = safe_eval(field_value, eval_ctx)
+            # Compiled once per process, as we get here for every field
+            # of every transaction
+            value = eval_expression(field_value, eval_ctx)
             # SEPA uses XML ; XML = UTF-8 ; UTF-8 = support for all characters
             # But we are dealing with banks...
             # and many banks don't want non-ASCCI characters !
             # cf section 1.4 "Character set" of the SEPA Credit Transfer
             # Scheme Customer-to-bank guidelines
             if gen_args.get('convert_to_ascii'):
-                value = unidecode(value)
-                unallowed_ascii_chars = [
-                    '"', '#', '$', '%', '&', '*', ';', '<', '>', '=', '@',
-                    '[', ']', '^', '_', '`', '{', '}', '|', '~', '\\', '!']
-                for unallowed_ascii_char in unallowed_ascii_chars:
-                    value = value.replace(unallowed_ascii_char, '-')
+                value = convert_to_pain_ascii(value)
         except Exception:
             error_msg_prefix = _("Cannot compute the field '{field_name}'.") \
                 .format(
@@ -149,40 +187,311 @@ class AccountPaymentOrder(models.Model):
 
     @api.model
     def _validate_xml(self, xml_string, gen_args):
-        xsd_etree_obj = etree.parse(
-            tools.file_open(gen_args['pain_xsd_file']))
-        official_pain_schema = etree.XMLSchema(xsd_etree_obj)
+        """Validate a serialized PAIN file. The files generated by this
+        module are validated with _validate_xml_root() and
+        _validate_xml_file(), without being parsed again."""
+        try:
+            xml_root = etree.fromstring(xml_string)
+        except Exception as e:
+            self._raise_invalid_xml(e, xml_string)
+        return self._validate_xml_root(xml_root, gen_args)
+
+    @api.model
+    def _get_validation_sample_size(self, gen_args):
+        """Return the number of PmtInf blocks to validate, 0 for all"""
+        if gen_args.get('validation') == 'sample':
+            return max(gen_args.get('validation_sample_size') or 0, 0)
+        return 0
 
+    @api.model
+    def _validate_xml_root(self, xml_root, gen_args):
+        """Validate the XML tree of a PAIN file as it was built"""
+        qualify_pain_tree(xml_root)
+        sample_size = self._get_validation_sample_size(gen_args)
         try:
-            root_to_validate = etree.fromstring(xml_string)
-            official_pain_schema.assertValid(root_to_validate)
+            with locked_pain_schema(
+                    gen_args['pain_xsd_file']) as official_pain_schema:
+                if sample_size:
+                    with sampled_payment_info_blocks(xml_root, sample_size):
+                        official_pain_schema.assertValid(xml_root)
+                else:
+                    official_pain_schema.assertValid(xml_root)
         except Exception as e:
-            logger.warning(
-                "The XML file is invalid against the XML Schema Definition")
-            logger.warning(xml_string)
-            logger.warning(e)
-            raise UserError(
-                _("The generated XML file is not valid against the official "
-                    "XML Schema Definition. The generated XML file and the "
-                    "full error have been written in the server logs. Here "
-                    "is the error, which may give you an idea on the cause "
-                    "of the problem : %s")
-                % str(e))
+            self._raise_invalid_xml(e, etree.tostring(
+                xml_root, pretty_print=True, encoding='UTF-8',
+                xml_declaration=True))
+        return True
+
+    @api.model
+    def _validate_xml_file(self, xml_file, payment_info_count, gen_args):
+        """Validate a PAIN file written by the streaming writer while
+        parsing it, dropping each PmtInf block once it is validated"""
+        sample_size = self._get_validation_sample_size(gen_args)
+        try:
+            with locked_pain_schema(
+                    gen_args['pain_xsd_file']) as official_pain_schema:
+                if sample_size:
+                    official_pain_schema.assertValid(parse_sampled_pain_file(
+                        xml_file, payment_info_count, sample_size))
+                else:
+                    for _event, block in etree.iterparse(
+                            xml_file, tag='{*}PmtInf',
+                            schema=official_pain_schema):
+                        block.getparent().remove(block)
+        except Exception as e:
+            xml_file.seek(0)
+            self._raise_invalid_xml(e, xml_file.read())
+        xml_file.seek(0)
+        return True
+
+    @api.model
+    def _raise_invalid_xml(self, error, xml_string):
+        logger.warning(
+            "The XML file is invalid against the XML Schema Definition")
+        logger.warning(xml_string)
+        logger.warning(error)
+        raise UserError(
+            _("The generated XML file is not valid against the official "
+                "XML Schema Definition. The generated XML file and the "
+                "full error have been written in the server logs. Here "
+                "is the error, which may give you an idea on the cause "
+                "of the problem : %s")
+            % str(error))
+
+    @api.multi
+    def _prefetch_payment_file_data(self):
+        """Read in bulk the records used to generate the payment file, so
+        that the transaction loop finds them in the cache instead of
+        reading them line by line. Inherit it to prefetch other records.
+        @return: dict of the prefetched recordsets
+        """
+        self.ensure_one()
+        bank_lines = self.bank_line_ids
+        payment_lines = bank_lines.mapped('payment_line_ids')
+        # Compute the related fields of all the bank lines at once
+        for field_name in [
+                'currency_id', 'partner_bank_id', 'date',
+                'communication_type', 'priority', 'local_instrument',
+                'category_purpose', 'purpose']:
+            bank_lines.mapped(field_name)
+        partner_banks = (
+            payment_lines.mapped('partner_bank_id') |
+            self.company_partner_bank_id)
+        partners = (
+            payment_lines.mapped('partner_id') |
+            partner_banks.mapped('partner_id'))
+        partner_banks.mapped('bank_bic')
+        partners.mapped('country_id.code')
+        payment_lines.mapped('currency_id.name')
+        return {
+            'bank_lines': bank_lines,
+            'payment_lines': payment_lines,
+            'partner_banks': partner_banks,
+            'partners': partners,
+        }
+
+    @api.multi
+    def generate_pain_writer(self, xml_root, gen_args):
+        """Return the writer the PmtInf and transaction blocks are handed
+        to once complete. With the 'streaming' generation argument, the
+        blocks are written to a temporary file as they are generated, so the
+        NbOfTxs and CtrlSum of the group header must already be set."""
+        pretty_print = self._get_pretty_print(gen_args)
+        if gen_args.get('streaming'):
+            writer = PainStreamWriter(xml_root, pretty_print=pretty_print)
+        else:
+            writer = PainTreeWriter(xml_root, pretty_print=pretty_print)
+        gen_args['pain_writer'] = writer
+        return writer
+
+    @api.model
+    def _get_pretty_print(self, gen_args):
+        """Compact output formats are serialized without indentation"""
+        return gen_args.get('output_format', 'pretty') == 'pretty'
+
+    @api.model
+    def _get_render_args(self, gen_args):
+        """Return the generation arguments given to the plain data
+        renderers, i.e. the ones that can be sent to a worker process"""
+        return {
+            key: value for key, value in gen_args.items()
+            if value is None or isinstance(value, (str, int, float, bool))}
+
+    @api.model
+    def _snapshot_party(self, partner, gen_args):
+        return PainParty(
+            zip=partner.zip,
+            city=partner.city,
+            country_code=partner.country_id.code,
+            street=partner.street,
+        )
+
+    @api.model
+    def _snapshot_bank_account(self, partner_bank, gen_args):
+        """Return the snapshot of a bank account, which is shared by all
+        its transactions"""
+        snapshots = gen_args.setdefault('bank_account_snapshots', {})
+        if partner_bank.id not in snapshots:
+            partner = partner_bank.partner_id
+            snapshots[partner_bank.id] = PainBankAccount(
+                id=partner_bank.id,
+                holder_name=partner_bank.acc_holder_name or partner.name,
+                acc_type=partner_bank.acc_type,
+                acc_number=partner_bank.sanitized_acc_number,
+                bic=partner_bank.bank_bic,
+                party=self._snapshot_party(partner, gen_args),
+            )
+        return snapshots[partner_bank.id]
+
+    @api.model
+    def _prepare_transaction_snapshot_vals(self, line, gen_args):
+        """Return the attributes of the snapshot of a bank payment line.
+        Designed to be inherited."""
+        return {
+            'id': line.id,
+            'name': line.name,
+            'currency': line.currency_id.name,
+            'amount': line.amount_currency,
+            'account': self._snapshot_bank_account(
+                line.partner_bank_id, gen_args),
+            'purpose': line.purpose,
+            'communication_type': line.communication_type,
+            'communication': line.communication,
+        }
+
+    @api.model
+    def _snapshot_transaction(self, line, gen_args):
+        return PainTransaction(
+            **self._prepare_transaction_snapshot_vals(line, gen_args))
+
+    @api.multi
+    def _snapshot_payment_order(self, gen_args):
+        """Convert the bank payment lines of the order to the plain data
+        snapshots of pain_snapshot, that the functions of pain_render
+        render without accessing the database. The generation of the file
+        has already prefetched their records.
+        @return: dict bank line id: transaction
+        """
+        self.ensure_one()
+        return {
+            line.id: self._snapshot_transaction(line, gen_args)
+            for line in self.bank_line_ids}
+
+    @api.multi
+    def _can_render_in_pool(self, gen_args):
+        """The transactions are rendered in forked processes only by the
+        background jobs of the payment orders run by a cron worker of a
+        multi-process server, as forking an HTTP worker or a threaded
+        server holding database connections and threads isn't safe, and
+        only when no installed module customizes a generation method,
+        which the rendering from snapshots would bypass"""
+        if gen_args.get('parallel_processes', 0) <= 1:
+            return False
+        if not config['workers']:
+            return False
+        if not self.env.context.get('payment_order_job_id'):
+            return False
+        overridden = self._get_overridden_generation_hooks()
+        if overridden:
+            logger.info(
+                "The transactions of the payment file are rendered in the "
+                "current process, as these methods are customized: %s",
+                ', '.join(overridden))
+            return False
         return True
 
+    @api.model
+    def _get_overridden_generation_hooks(self):
+        """Return the names of the generation methods of this module that
+        are overridden by an installed module"""
+        cls = type(self)
+        return sorted(
+            name for name, method in vars(AccountPaymentOrder).items()
+            if (name.startswith('generate_') or name == '_prepare_field') and
+            getattr(cls, name) is not method)
+
+    @api.multi
+    def _render_transactions_in_pool(
+            self, render_transaction, lines_per_group, gen_args):
+        """Render the transaction blocks of the PmtInf groups in parallel
+        processes, from the snapshots of the lines. The generation hooks
+        of this model are not called for these blocks.
+        @param render_transaction: module level function called with
+            (parent_node, transaction snapshot, render args) for each line
+        @param lines_per_group: list of the bank lines of each group
+        @return: list of the serialized blocks of each group (bytes)
+        """
+        render_args = self._get_render_args(gen_args)
+        transactions = self._snapshot_payment_order(gen_args)
+        jobs = []
+        job_groups = []
+        for index, lines in enumerate(lines_per_group):
+            for start in range(0, len(lines), PARALLEL_CHUNK_SIZE):
+                jobs.append((render_transaction, render_args, [
+                    transactions[line.id]
+                    for line in lines[start:start + PARALLEL_CHUNK_SIZE]]))
+                job_groups.append(index)
+        try:
+            results = render_in_pool(
+                render_transactions_job, jobs,
+                gen_args['parallel_processes'])
+        except PainRenderError as e:
+            raise UserError(str(e))
+        fragments = [[] for index in range(len(lines_per_group))]
+        for index, result in zip(job_groups, results):
+            fragments[index].append(result)
+        return [b''.join(fragment) for fragment in fragments]
+
     @api.multi
     def finalize_sepa_file_creation(self, xml_root, gen_args):
-        xml_string = etree.tostring(
-            xml_root, pretty_print=True, encoding='UTF-8',
-            xml_declaration=True)
+        writer = gen_args.get('pain_writer')
+        filename = '%s%s.xml' % (gen_args['file_prefix'], self.name)
+        cache = gen_args.get('party_block_cache')
+        if cache:
+            logger.debug(
+                "Party blocks: %d rendered, %d copied from the cache",
+                cache.misses, cache.hits)
+        # Validate what we have at hand rather than parsing the
+        # serialized file again: the tree, or the streamed file
+        if writer and writer.streaming:
+            xml_file = writer.finish()
+            self._validate_xml_file(
+                xml_file, writer.payment_info_count, gen_args)
+            logger.debug(
+                "Generated SEPA XML file in format %s (streamed)"
+                % gen_args['pain_flavor'])
+            # Compressed from the spooled file by chunks
+            try:
+                return compress_payment_file(
+                    xml_file, filename, gen_args.get('output_format'))
+            finally:
+                xml_file.close()
+        self._validate_xml_root(xml_root, gen_args)
+        if writer:
+            xml_string = writer.close()
+        else:
+            xml_string = etree.tostring(
+                xml_root, pretty_print=self._get_pretty_print(gen_args),
+                encoding='UTF-8', xml_declaration=True)
         logger.debug(
             "Generated SEPA XML file in format %s below"
             % gen_args['pain_flavor'])
         logger.debug(xml_string)
-        self._validate_xml(xml_string, gen_args)
+        return compress_payment_file(
+            xml_string, filename, gen_args.get('output_format'))
 
-        filename = '%s%s.xml' % (gen_args['file_prefix'], self.name)
-        return (xml_string, filename)
+    @api.multi
+    def _prepare_payment_file_attachment_vals(self, payment_file_str,
+                                              filename):
+        vals = super(AccountPaymentOrder, self).\
+            _prepare_payment_file_attachment_vals(payment_file_str, filename)
+        # The mimetype guessed from 'xxx.xml.gz' would be text/xml
+        output_format = self.payment_mode_id.pain_output_format
+        if output_format == 'gzip' and filename.endswith('.gz'):
+            vals['mimetype'] = 'application/gzip'
+        elif output_format == 'zip' and filename.endswith('.zip'):
+            vals['mimetype'] = 'application/zip'
+        return vals
 
     @api.multi
     def generate_pain_nsmap(self):
@@ -444,6 +753,20 @@ class AccountPaymentOrder(models.Model):
         In some localization (l10n_ch_sepa for example), they need the
         bank_line argument"""
         assert order in ('B', 'C'), "Order can be 'B' or 'C'"
+        # The same few bank accounts come back in many transactions, and
+        # the creditor/debtor block in every PmtInf. The cache is created
+        # once per file; gen_args['party_block_cache'] = None disables it.
+        if 'party_block_cache' not in gen_args:
+            gen_args['party_block_cache'] = PainFragmentCache()
+        cache = gen_args['party_block_cache']
+        cache_key = cache is not None and self._get_party_block_cache_key(
+            party_type, order, partner_bank, gen_args, bank_line=bank_line)
+        if cache_key:
+            elements = cache.get(cache_key)
+            if elements is not None:
+                parent_node.extend(elements)
+                return True
+            start = len(parent_node)
         party_type_label = _("Partner name")
         if party_type == 'Cdtr':
             party_type_label = _("Creditor name")
@@ -477,8 +800,27 @@ class AccountPaymentOrder(models.Model):
             self.generate_party_agent(
                 parent_node, party_type, order, partner_bank, gen_args,
                 bank_line=bank_line)
+        if cache_key:
+            cache.set(cache_key, parent_node[start:])
         return True
 
+    @api.model
+    def _get_party_block_cache_key(
+            self, party_type, order, partner_bank, gen_args, bank_line=None):
+        """Return the key under which the party block of partner_bank is
+        cached during the generation of the file, or None to render it
+        every time. The blocks of a bank line are not cached when a module
+        overrides one of the methods rendering them, which may read it."""
+        if bank_line:
+            if 'party_block_line_hooks' not in gen_args:
+                gen_args['party_block_line_hooks'] = [
+                    name for name in self._get_overridden_generation_hooks()
+                    if name in PARTY_BLOCK_HOOKS]
+            if gen_args['party_block_line_hooks']:
+                return None
+        return (
+            partner_bank.id, party_type, order, gen_args.get('pain_flavor'))
+
     @api.model
     def generate_remittance_info_block(self, parent_node, line, gen_args):
         remittance_info = etree.SubElement(
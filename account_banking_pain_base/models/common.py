@@ -0,0 +1,279 @@
+# Copyright 2013-2016 Akretion - Alexis de Lattre
+# Copyright 2014 Tecnativa - Pedro M. Baeza
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import lru_cache
+import gzip
+import io
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import zipfile
+
+from lxml import etree
+
+from odoo import tools
+from odoo.tools.safe_eval import _BUILTINS, _SAFE_OPCODES, test_expr
+
+try:
+    from odoo.tools.safe_eval import check_values
+except ImportError:
+    check_values = None
+
+try:
+    from unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks of a streamed payment file copied to its compressed
+# version
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The field expressions used by the PAIN generators are a small, fixed set
+# ('line.name', 'partner.zip'...), so a few hundred slots are plenty even
+# with localization modules adding their own
+EXPRESSION_CACHE_SIZE = 512
+
+unsafe_eval = eval
+
+# cf section 1.4 "Character set" of the SEPA Credit Transfer Scheme
+# Customer-to-bank guidelines
+UNALLOWED_ASCII_CHARS = [
+    '"', '#', '$', '%', '&', '*', ';', '<', '>', '=', '@',
+    '[', ']', '^', '_', '`', '{', '}', '|', '~', '\\', '!']
+_UNALLOWED_ASCII_RE = re.compile(
+    '[%s]' % re.escape(''.join(UNALLOWED_ASCII_CHARS)))
+
+# Partner names, cities and streets repeat a lot among the transactions
+ASCII_CACHE_SIZE = 4096
+
+# Compiled XML Schemas, shared by all the threads of the process, so that
+# the schemas compiled when the registry is loaded serve every thread.
+# Each schema comes with its own lock, as lxml validators must not be used
+# concurrently.
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(expr):
+    """Compile a field expression once per process
+    The opcodes are checked against the same whitelist as safe_eval()
+    @param expr: the expression as str
+    @return: the compiled code object
+    """
+    logger.debug("Compiling PAIN field expression %r", expr)
+    return test_expr(expr, _SAFE_OPCODES, mode='eval')
+
+
+def eval_expression(expr, eval_ctx):
+    """Evaluate a field expression in the safe_eval() sandbox, using the
+    compiled code cached by compile_expression()
+    @param expr: the expression as str
+    @param eval_ctx: dict with the evaluation context
+    @return: the value of the expression
+    """
+    code = compile_expression(expr)
+    # Work on a copy, like safe_eval() does, so that the sandboxed code
+    # can't alter the context of the caller
+    globals_dict = dict(eval_ctx)
+    if check_values is not None:
+        check_values(globals_dict)
+    globals_dict['__builtins__'] = _BUILTINS
+    return unsafe_eval(code, globals_dict)
+
+
+@lru_cache(maxsize=ASCII_CACHE_SIZE)
+def convert_to_pain_ascii(value):
+    """Convert a value to the ASCII characters accepted by the banks
+    @param value: str
+    @return: str with only ASCII characters
+    """
+    try:
+        # Most values are already ASCII, which unidecode() would return
+        # unchanged, only much slower
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        value = unidecode(value)
+    # A single pass, which is faster than str.translate() on such short
+    # strings
+    return _UNALLOWED_ASCII_RE.sub('-', value)
+
+
+def _get_pain_schema_entry(xsd_path):
+    """Return the (mtime, schema, lock) entry of an XSD file in the
+    registry, compiling the schema if it is missing or outdated"""
+    with tools.file_open(xsd_path, 'rb') as xsd_file:
+        mtime = os.fstat(xsd_file.fileno()).st_mtime
+        with _schemas_lock:
+            cached = _schemas.get(xsd_path)
+            if cached and cached[0] == mtime:
+                return cached
+            # Compiled under the lock, so that concurrent threads don't
+            # all compile the same schema
+            logger.debug("Compiling XML Schema %s", xsd_path)
+            entry = (
+                mtime, etree.XMLSchema(etree.parse(xsd_file)),
+                threading.Lock())
+            _schemas[xsd_path] = entry
+    return entry
+
+
+def get_pain_schema(xsd_path):
+    """Return the compiled XML Schema of an XSD file, which is only parsed
+    and compiled again if the file has been modified. The schema is shared
+    by all the threads: use locked_pain_schema() to validate with it
+    @param xsd_path: path of the XSD file, as given to tools.file_open()
+    @return: etree.XMLSchema object
+    """
+    return _get_pain_schema_entry(xsd_path)[1]
+
+
+@contextmanager
+def locked_pain_schema(xsd_path):
+    """Context manager giving the compiled XML Schema of an XSD file, which
+    no other thread can use until the context is exited
+    @param xsd_path: path of the XSD file, as given to tools.file_open()
+    """
+    _mtime, schema, lock = _get_pain_schema_entry(xsd_path)
+    with lock:
+        yield schema
+
+
+def clear_pain_schema_cache():
+    """Drop the compiled XML Schemas"""
+    with _schemas_lock:
+        _schemas.clear()
+
+
+def qualify_pain_tree(xml_root):
+    """Put the elements of a PAIN tree, which the generators build with
+    unqualified tags, in the default namespace declared on its root, as
+    they are once the serialized file is parsed. The tree can then be
+    validated against the XML Schema, and serializes the same.
+    The tree is modified in place rather than copied, so that a large
+    file isn't held twice in memory: the caller's tree is qualified.
+    @param xml_root: the Document element, modified in place
+    """
+    namespace = xml_root.nsmap.get(None)
+    if not namespace:
+        return
+    prefix = '{%s}' % namespace
+    for element in xml_root.iter(tag=etree.Element):
+        if not element.tag.startswith('{'):
+            element.tag = prefix + element.tag
+
+
+def sample_indexes(count, sample_size):
+    """Return the indexes of sample_size items evenly spread over count
+    items, the first and the last ones included"""
+    if sample_size >= count:
+        return set(range(count))
+    if sample_size == 1:
+        return {0}
+    return {
+        i * (count - 1) // (sample_size - 1) for i in range(sample_size)}
+
+
+@contextmanager
+def sampled_payment_info_blocks(xml_root, sample_size):
+    """Context manager detaching from the PAIN tree all its PmtInf blocks
+    but sample_size of them, and putting them back on exit, so that the
+    sample can be validated without copying the tree
+    @param xml_root: the Document element
+    @param sample_size: number of PmtInf blocks to keep
+    """
+    pain_root = xml_root[0]
+    children = list(pain_root)
+    blocks = [
+        child for child in children
+        if etree.QName(child).localname == 'PmtInf']
+    kept = sample_indexes(len(blocks), sample_size)
+    for index, block in enumerate(blocks):
+        if index not in kept:
+            pain_root.remove(block)
+    try:
+        yield xml_root
+    finally:
+        for index, child in enumerate(children):
+            if child.getparent() is None:
+                pain_root.insert(index, child)
+
+
+def parse_sampled_pain_file(xml_file, payment_info_count, sample_size):
+    """Parse a serialized PAIN file, keeping only sample_size of its
+    PmtInf blocks, so that the memory used doesn't grow with the file
+    @param xml_file: file object, at the start of the XML file
+    @param payment_info_count: number of PmtInf blocks of the file
+    @param sample_size: number of PmtInf blocks to keep
+    @return: the Document element of the sampled tree
+    """
+    kept = sample_indexes(payment_info_count, sample_size)
+    context = etree.iterparse(xml_file, tag='{*}PmtInf')
+    for index, (_event, block) in enumerate(context):
+        if index not in kept:
+            block.getparent().remove(block)
+    return context.root
+
+
+class PainFragmentCache(object):
+    """Rendered XML fragments of a payment file, reused as deep copies
+    instead of being rendered again"""
+
+    def __init__(self):
+        self.fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return copies of the elements cached for key, or None"""
+        elements = self.fragments.get(key)
+        if elements is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [deepcopy(element) for element in elements]
+
+    def set(self, key, elements):
+        self.fragments[key] = [deepcopy(element) for element in elements]
+
+
+def compress_payment_file(data, filename, output_format):
+    """Compress a payment file according to the output format of the
+    payment mode
+    @param data: the file as bytes, or as a file object positioned at its
+        start, as returned by PainStreamWriter.finish(), which is then
+        compressed by chunks without being read in memory as a whole
+    @param filename: name of the file
+    @param output_format: 'gzip' or 'zip', other values leave the file as is
+    @return: tuple (data, filename), data being bytes: the attachments of
+        Odoo 12 only take the whole (base64 encoded) content
+    """
+    is_file = hasattr(data, 'read')
+    if output_format == 'gzip':
+        buf = io.BytesIO()
+        with gzip.GzipFile(filename, mode='wb', fileobj=buf) as gzip_file:
+            if is_file:
+                shutil.copyfileobj(data, gzip_file, COPY_CHUNK_SIZE)
+            else:
+                gzip_file.write(data)
+        return buf.getvalue(), filename + '.gz'
+    if output_format == 'zip':
+        buf = io.BytesIO()
+        with zipfile.ZipFile(
+                buf, mode='w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            if is_file and sys.version_info >= (3, 6):
+                # Writing to a member of the archive needs Python 3.6
+                with zip_file.open(filename, mode='w') as member:
+                    shutil.copyfileobj(data, member, COPY_CHUNK_SIZE)
+            else:
+                zip_file.writestr(filename, data.read() if is_file else data)
+        return buf.getvalue(), os.path.splitext(filename)[0] + '.zip'
+    return (data.read() if is_file else data), filename
@@ -0,0 +1,55 @@
+# Copyright 2013-2016 Akretion - Alexis de Lattre
+# Copyright 2014 Tecnativa - Pedro M. Baeza
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import multiprocessing
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Number of transactions rendered by a job, so that a large PmtInf group
+# is spread over several processes
+PARALLEL_CHUNK_SIZE = 1000
+
+
+def render_transactions_job(job):
+    """Render transaction blocks in a worker process
+    @param job: tuple (render_transaction, render_args, transactions),
+        render_transaction being a module level function called with
+        (parent_node, transaction, render_args) for each transaction
+    @return: the serialized blocks, as UTF-8 bytes
+    """
+    render_transaction, render_args, transactions = job
+    pretty_print = render_args.get('output_format', 'pretty') == 'pretty'
+    payment_info = etree.Element('PmtInf')
+    for transaction in transactions:
+        render_transaction(payment_info, transaction, render_args)
+    return b''.join(
+        etree.tostring(block, pretty_print=pretty_print, encoding='UTF-8')
+        for block in payment_info)
+
+
+def render_in_pool(func, jobs, processes):
+    """Call func on each job in a pool of forked processes
+    @param func: module level function, called with a job
+    @param jobs: list of picklable jobs
+    @param processes: maximum number of processes
+    @return: list of the results, in the order of the jobs
+    """
+    processes = min(processes, len(jobs))
+    context = None
+    if processes > 1:
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            logger.warning(
+                "Processes can't be forked on this platform, the payment "
+                "file is generated in the current process.")
+    if context is None:
+        return [func(job) for job in jobs]
+    logger.debug(
+        "Rendering %d jobs in %d processes", len(jobs), processes)
+    with context.Pool(processes) as pool:
+        return pool.map(func, jobs, chunksize=1)
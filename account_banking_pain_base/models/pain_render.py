@@ -0,0 +1,172 @@
+# Copyright 2013-2016 Akretion - Alexis de Lattre
+# Copyright 2014 Tecnativa - Pedro M. Baeza
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from lxml import etree
+
+from .common import convert_to_pain_ascii
+
+# The renderers below build the same blocks as the generate_*() methods of
+# account.payment.order, but from the snapshots of pain_snapshot, without
+# any access to the ORM, so that they can run in worker processes.
+
+
+class PainRenderError(ValueError):
+    """Invalid value met by a renderer. UserError is not used, as the
+    error has to be sent back from the worker processes"""
+
+
+def prepare_value(field_name, value, max_size=0, render_args=None):
+    """Plain data counterpart of AccountPaymentOrder._prepare_field()
+    @param field_name: label of the field, for the error messages
+    @param value: the value of the field
+    @param max_size: the value is truncated to max_size characters
+    @param render_args: the plain generation arguments
+    @return: the value as str
+    """
+    if value and not isinstance(value, str):
+        raise PainRenderError(
+            "The type of the field '%s' is %s. It should be a string "
+            "or unicode." % (field_name, type(value)))
+    if value and render_args and render_args.get('convert_to_ascii'):
+        value = convert_to_pain_ascii(value)
+    if not value:
+        raise PainRenderError(
+            "The '%s' is empty or 0. It should have a non-null value."
+            % field_name)
+    if max_size and len(value) > max_size:
+        value = value[0:max_size]
+    return value
+
+
+def render_party_agent(
+        parent_node, party_type, order, account, render_args):
+    """Plain data counterpart of generate_party_agent()"""
+    assert order in ('B', 'C'), "Order can be 'B' or 'C'"
+    if account.bic:
+        party_agent = etree.SubElement(parent_node, '%sAgt' % party_type)
+        party_agent_institution = etree.SubElement(
+            party_agent, 'FinInstnId')
+        party_agent_bic = etree.SubElement(
+            party_agent_institution, render_args.get('bic_xml_tag'))
+        party_agent_bic.text = account.bic
+    elif order == 'B' or (
+            order == 'C' and render_args['payment_method'] == 'DD'):
+        party_agent = etree.SubElement(parent_node, '%sAgt' % party_type)
+        party_agent_institution = etree.SubElement(
+            party_agent, 'FinInstnId')
+        party_agent_other = etree.SubElement(
+            party_agent_institution, 'Othr')
+        party_agent_other_identification = etree.SubElement(
+            party_agent_other, 'Id')
+        party_agent_other_identification.text = 'NOTPROVIDED'
+
+
+def render_party_acc_number(parent_node, party_type, account):
+    """Plain data counterpart of generate_party_acc_number()"""
+    party_account = etree.SubElement(parent_node, '%sAcct' % party_type)
+    party_account_id = etree.SubElement(party_account, 'Id')
+    if account.acc_type == 'iban':
+        party_account_iban = etree.SubElement(party_account_id, 'IBAN')
+        party_account_iban.text = account.acc_number
+    else:
+        party_account_other = etree.SubElement(party_account_id, 'Othr')
+        party_account_other_id = etree.SubElement(
+            party_account_other, 'Id')
+        party_account_other_id.text = account.acc_number
+
+
+def render_address(parent_node, party, render_args):
+    """Plain data counterpart of generate_address_block()"""
+    if not party.country_code:
+        return
+    postal_address = etree.SubElement(parent_node, 'PstlAdr')
+    pain_flavor = render_args.get('pain_flavor')
+    if pain_flavor.startswith('pain.001.001.') or pain_flavor.startswith(
+            'pain.008.001.'):
+        if party.zip:
+            pstcd = etree.SubElement(postal_address, 'PstCd')
+            pstcd.text = prepare_value(
+                'Postal Code', party.zip, 16, render_args)
+        if party.city:
+            twnnm = etree.SubElement(postal_address, 'TwnNm')
+            twnnm.text = prepare_value(
+                'Town Name', party.city, 35, render_args)
+    country = etree.SubElement(postal_address, 'Ctry')
+    country.text = prepare_value(
+        'Country', party.country_code, 2, render_args)
+    if party.street:
+        adrline1 = etree.SubElement(postal_address, 'AdrLine')
+        adrline1.text = prepare_value(
+            'Adress Line1', party.street, 70, render_args)
+
+
+def render_party(parent_node, party_type, order, account, render_args):
+    """Plain data counterpart of generate_party_block()"""
+    assert order in ('B', 'C'), "Order can be 'B' or 'C'"
+    party_type_label = "Partner name"
+    if party_type == 'Cdtr':
+        party_type_label = "Creditor name"
+    elif party_type == 'Dbtr':
+        party_type_label = "Debtor name"
+    party_name = prepare_value(
+        party_type_label, account.holder_name,
+        render_args.get('name_maxsize'), render_args)
+    # At C level, the order is : BIC, Name, IBAN
+    # At B level, the order is : Name, IBAN, BIC
+    if order == 'C':
+        render_party_agent(
+            parent_node, party_type, order, account, render_args)
+    party = etree.SubElement(parent_node, party_type)
+    party_nm = etree.SubElement(party, 'Nm')
+    party_nm.text = party_name
+    render_address(party, account.party, render_args)
+    render_party_acc_number(parent_node, party_type, account)
+    if order == 'B':
+        render_party_agent(
+            parent_node, party_type, order, account, render_args)
+
+
+def render_remittance_info(parent_node, transaction, render_args):
+    """Plain data counterpart of generate_remittance_info_block()"""
+    remittance_info = etree.SubElement(parent_node, 'RmtInf')
+    if transaction.communication_type == 'normal':
+        remittance_info_unstructured = etree.SubElement(
+            remittance_info, 'Ustrd')
+        remittance_info_unstructured.text = prepare_value(
+            'Remittance Unstructured Information',
+            transaction.communication, 140, render_args)
+        return
+    remittance_info_structured = etree.SubElement(remittance_info, 'Strd')
+    creditor_ref_information = etree.SubElement(
+        remittance_info_structured, 'CdtrRefInf')
+    if render_args.get('pain_flavor') == 'pain.001.001.02':
+        creditor_ref_info_type = etree.SubElement(
+            creditor_ref_information, 'CdtrRefTp')
+        creditor_ref_info_type_code = etree.SubElement(
+            creditor_ref_info_type, 'Cd')
+        creditor_ref_info_type_code.text = 'SCOR'
+        creditor_ref_info_type_issuer = etree.SubElement(
+            creditor_ref_info_type, 'Issr')
+        creditor_ref_info_type_issuer.text = \
+            transaction.communication_type
+        creditor_reference = etree.SubElement(
+            creditor_ref_information, 'CdtrRef')
+    else:
+        if render_args.get('structured_remittance_issuer', True):
+            creditor_ref_info_type = etree.SubElement(
+                creditor_ref_information, 'Tp')
+            creditor_ref_info_type_or = etree.SubElement(
+                creditor_ref_info_type, 'CdOrPrtry')
+            creditor_ref_info_type_code = etree.SubElement(
+                creditor_ref_info_type_or, 'Cd')
+            creditor_ref_info_type_code.text = 'SCOR'
+            creditor_ref_info_type_issuer = etree.SubElement(
+                creditor_ref_info_type, 'Issr')
+            creditor_ref_info_type_issuer.text = \
+                transaction.communication_type
+        creditor_reference = etree.SubElement(
+            creditor_ref_information, 'Ref')
+    creditor_reference.text = prepare_value(
+        'Creditor Structured Reference', transaction.communication, 35,
+        render_args)
@@ -0,0 +1,68 @@
+# Copyright 2013-2016 Akretion - Alexis de Lattre
+# Copyright 2014 Tecnativa - Pedro M. Baeza
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+# Plain data copies of the records used to render a payment file, built
+# by AccountPaymentOrder._snapshot_payment_order(). They only hold str,
+# float, bool and other snapshots, so they can be rendered by the
+# functions of pain_render and sent to worker processes.
+
+
+_field_names = {}
+
+
+class PainSnapshot(object):
+    """Base of the snapshots: a fixed set of attributes, given as
+    keyword arguments, the missing ones being None"""
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self._fields():
+            setattr(self, name, values.pop(name, None))
+        if values:
+            raise TypeError(
+                "Unknown attributes for %s: %s"
+                % (type(self).__name__, ', '.join(sorted(values))))
+
+    @classmethod
+    def _fields(cls):
+        names = _field_names.get(cls)
+        if names is None:
+            names = _field_names[cls] = tuple(
+                name for klass in reversed(cls.__mro__)
+                for name in getattr(klass, '__slots__', ()))
+        return names
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self._fields())
+
+    def __setstate__(self, state):
+        for name, value in zip(self._fields(), state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (name, getattr(self, name))
+            for name in self._fields()))
+
+
+class PainParty(PainSnapshot):
+    """Partner of a bank account, for the postal address"""
+
+    __slots__ = ('zip', 'city', 'country_code', 'street')
+
+
+class PainBankAccount(PainSnapshot):
+    """res.partner.bank, with its holder"""
+
+    __slots__ = (
+        'id', 'holder_name', 'acc_type', 'acc_number', 'bic', 'party')
+
+
+class PainTransaction(PainSnapshot):
+    """bank.payment.line, for the transaction blocks"""
+
+    __slots__ = (
+        'id', 'name', 'currency', 'amount', 'account', 'purpose',
+        'communication_type', 'communication')
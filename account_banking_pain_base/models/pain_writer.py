@@ -0,0 +1,120 @@
+# Copyright 2013-2016 Akretion - Alexis de Lattre
+# Copyright 2014 Tecnativa - Pedro M. Baeza
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from contextlib import ExitStack
+import tempfile
+
+from lxml import etree
+
+# Above this size, the streamed PAIN file is moved from memory to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class PainTreeWriter(object):
+    """Default writer: the blocks stay in the XML tree, which is
+    serialized as a whole when the file is finalized"""
+
+    streaming = False
+
+    def __init__(self, xml_root, pretty_print=True):
+        self.xml_root = xml_root
+        self.pretty_print = pretty_print
+        self.payment_info_count = 0
+
+    def start_payment_info(self, payment_info):
+        """Called when the header of a PmtInf block is complete"""
+        return
+
+    def add_transaction(self, payment_info, transaction):
+        """Called when a transaction block of payment_info is complete"""
+        return
+
+    def add_transactions_xml(self, payment_info, xml):
+        """Add serialized transaction blocks to payment_info
+        @param xml: the blocks, as UTF-8 bytes
+        """
+        parser = etree.XMLParser(remove_blank_text=True)
+        blocks = etree.fromstring(b'<PmtInf>' + xml + b'</PmtInf>', parser)
+        payment_info.extend(list(blocks))
+
+    def end_payment_info(self, payment_info):
+        """Called when all the transactions of payment_info are added"""
+        self.payment_info_count += 1
+
+    def close(self):
+        """Return the serialized XML file as bytes"""
+        return etree.tostring(
+            self.xml_root, pretty_print=self.pretty_print, encoding='UTF-8',
+            xml_declaration=True)
+
+
+class PainStreamWriter(PainTreeWriter):
+    """Writer that serializes each block to a spooled temporary file as
+    soon as it is complete and drops it from the tree, so that the memory
+    used doesn't grow with the number of transactions.
+    As the group header is written first, its NbOfTxs and CtrlSum must be
+    set before the writer is created.
+    """
+
+    streaming = True
+
+    def __init__(self, xml_root, pretty_print=True):
+        super(PainStreamWriter, self).__init__(
+            xml_root, pretty_print=pretty_print)
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._stack = ExitStack()
+        self._payment_info_element = None
+        self.xf = self._stack.enter_context(
+            etree.xmlfile(self.spool, encoding='UTF-8'))
+        self.xf.write_declaration()
+        self._stack.enter_context(self.xf.element(
+            xml_root.tag, attrib=dict(xml_root.attrib),
+            nsmap=xml_root.nsmap))
+        self.pain_root = xml_root[0]
+        self._stack.enter_context(self.xf.element(self.pain_root.tag))
+        # Group header
+        for child in list(self.pain_root):
+            self._write(child)
+
+    def _write(self, element):
+        # Detached first, as lxml would otherwise repeat the namespace
+        # declarations of the Document on each written block
+        element.getparent().remove(element)
+        self.xf.write(element, pretty_print=self.pretty_print)
+
+    def start_payment_info(self, payment_info):
+        self._payment_info_element = self.xf.element(payment_info.tag)
+        self._payment_info_element.__enter__()
+        for child in list(payment_info):
+            self._write(child)
+
+    def add_transaction(self, payment_info, transaction):
+        self._write(transaction)
+
+    def add_transactions_xml(self, payment_info, xml):
+        # Copied as is to the file, after what lxml has buffered
+        self.xf.flush()
+        self.spool.write(xml)
+
+    def end_payment_info(self, payment_info):
+        super(PainStreamWriter, self).end_payment_info(payment_info)
+        self._payment_info_element.__exit__(None, None, None)
+        self._payment_info_element = None
+        self.pain_root.remove(payment_info)
+
+    def finish(self):
+        """End the XML document and return the temporary file it is
+        written to, positioned at its start"""
+        self._stack.close()
+        self.spool.seek(0)
+        return self.spool
+
+    def close(self):
+        """Return the whole file as bytes. Prefer finish(), whose file
+        object can be compressed by chunks: the bytes are only needed by
+        the uncompressed output, as the attachments of Odoo 12 take their
+        whole content at once."""
+        xml_string = self.finish().read()
+        self.spool.close()
+        return xml_string
@@ -4,9 +4,42 @@
 
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.addons.account_banking_pain_base.models.pain_render import (
+    prepare_value, render_party, render_remittance_info)
 from lxml import etree
 
 
+def render_sct_transaction(parent_node, transaction, render_args):
+    """Render the CdtTrfTxInf block of a transaction from its snapshot,
+    as generate_payment_file() does from the bank payment line"""
+    credit_transfer_transaction_info = etree.SubElement(
+        parent_node, 'CdtTrfTxInf')
+    payment_identification = etree.SubElement(
+        credit_transfer_transaction_info, 'PmtId')
+    instruction_identification = etree.SubElement(
+        payment_identification, 'InstrId')
+    instruction_identification.text = prepare_value(
+        'Instruction Identification', transaction.name, 35, render_args)
+    end2end_identification = etree.SubElement(
+        payment_identification, 'EndToEndId')
+    end2end_identification.text = prepare_value(
+        'End to End Identification', transaction.name, 35, render_args)
+    currency_name = prepare_value(
+        'Currency Code', transaction.currency, 3, render_args)
+    amount = etree.SubElement(credit_transfer_transaction_info, 'Amt')
+    instructed_amount = etree.SubElement(
+        amount, 'InstdAmt', Ccy=currency_name)
+    instructed_amount.text = '%.2f' % transaction.amount
+    render_party(
+        credit_transfer_transaction_info, 'Cdtr', 'C',
+        transaction.account, render_args)
+    if transaction.purpose:
+        purpose = etree.SubElement(credit_transfer_transaction_info, 'Purp')
+        etree.SubElement(purpose, 'Cd').text = transaction.purpose
+    render_remittance_info(
+        credit_transfer_transaction_info, transaction, render_args)
+
+
 class AccountPaymentOrder(models.Model):
     _inherit = 'account.payment.order'
 
@@ -16,6 +49,7 @@ class AccountPaymentOrder(models.Model):
         self.ensure_one()
         if self.payment_method_id.code != 'sepa_credit_transfer':
             return super(AccountPaymentOrder, self).generate_payment_file()
+        self._prefetch_payment_file_data()
 
         pain_flavor = self.payment_method_id.pain_version
         # We use pain_flavor.startswith('pain.001.001.xx')
@@ -67,6 +101,13 @@ class AccountPaymentOrder(models.Model):
             'file_prefix': 'sct_',
             'pain_flavor': pain_flavor,
             'pain_xsd_file': xsd_file,
+            'streaming': self.payment_method_id.pain_streaming,
+            'validation': self.payment_method_id.pain_validation,
+            'validation_sample_size':
+                self.payment_method_id.pain_validation_sample_size,
+            'parallel_processes':
+                self.payment_method_id.pain_parallel_processes,
+            'output_format': self.payment_mode_id.pain_output_format,
         }
         nsmap = self.generate_pain_nsmap()
         attrib = self.generate_pain_attrib()
@@ -93,8 +134,23 @@ class AccountPaymentOrder(models.Model):
                 lines_per_group[key].append(line)
             else:
                 lines_per_group[key] = [line]
-        for (requested_date, priority, local_instrument, categ_purpose),\
-                lines in list(lines_per_group.items()):
+        # The control sums are computed before generating the blocks, as the
+        # streaming writer needs complete headers
+        for lines in lines_per_group.values():
+            for line in lines:
+                transactions_count_a += 1
+                amount_control_sum_a += line.amount_currency
+        nb_of_transactions_a.text = str(transactions_count_a)
+        control_sum_a.text = '%.2f' % amount_control_sum_a
+        writer = self.generate_pain_writer(xml_root, gen_args)
+        groups = list(lines_per_group.items())
+        fragments = None
+        if self._can_render_in_pool(gen_args):
+            fragments = self._render_transactions_in_pool(
+                render_sct_transaction, [lines for key, lines in groups],
+                gen_args)
+        for index, ((requested_date, priority, local_instrument,
+                     categ_purpose), lines) in enumerate(groups):
             # B. Payment info
             requested_date = fields.Date.to_string(requested_date)
             payment_info, nb_of_transactions_b, control_sum_b = \
@@ -120,11 +176,18 @@ class AccountPaymentOrder(models.Model):
             else:
                 charge_bearer_text = self.charge_bearer
             charge_bearer.text = charge_bearer_text
-            transactions_count_b = 0
-            amount_control_sum_b = 0.0
+            if not pain_flavor.startswith('pain.001.001.02'):
+                amount_control_sum_b = 0.0
+                for line in lines:
+                    amount_control_sum_b += line.amount_currency
+                nb_of_transactions_b.text = str(len(lines))
+                control_sum_b.text = '%.2f' % amount_control_sum_b
+            writer.start_payment_info(payment_info)
+            if fragments is not None:
+                writer.add_transactions_xml(payment_info, fragments[index])
+                # Already rendered in the pool
+                lines = []
             for line in lines:
-                transactions_count_a += 1
-                transactions_count_b += 1
                 # C. Credit Transfer Transaction Info
                 credit_transfer_transaction_info = etree.SubElement(
                     payment_info, 'CdtTrfTxInf')
@@ -148,8 +211,6 @@ class AccountPaymentOrder(models.Model):
                 instructed_amount = etree.SubElement(
                     amount, 'InstdAmt', Ccy=currency_name)
                 instructed_amount.text = '%.2f' % line.amount_currency
-                amount_control_sum_a += line.amount_currency
-                amount_control_sum_b += line.amount_currency
                 if not line.partner_bank_id:
                     raise UserError(
                         _("Bank account is missing on the bank payment line "
@@ -164,13 +225,17 @@ class AccountPaymentOrder(models.Model):
                     etree.SubElement(purpose, 'Cd').text = line.purpose
                 self.generate_remittance_info_block(
                     credit_transfer_transaction_info, line, gen_args)
-            if not pain_flavor.startswith('pain.001.001.02'):
-                nb_of_transactions_b.text = str(transactions_count_b)
-                control_sum_b.text = '%.2f' % amount_control_sum_b
-        if not pain_flavor.startswith('pain.001.001.02'):
-            nb_of_transactions_a.text = str(transactions_count_a)
-            control_sum_a.text = '%.2f' % amount_control_sum_a
-        else:
-            nb_of_transactions_a.text = str(transactions_count_a)
-            control_sum_a.text = '%.2f' % amount_control_sum_a
+                writer.add_transaction(
+                    payment_info, credit_transfer_transaction_info)
+            writer.end_payment_info(payment_info)
         return self.finalize_sepa_file_creation(xml_root, gen_args)
+
+    @api.model
+    def _prepare_transaction_snapshot_vals(self, line, gen_args):
+        if gen_args['payment_method'] == 'TRF' and not line.partner_bank_id:
+            raise UserError(
+                _("Bank account is missing on the bank payment line "
+                    "of partner '%s' (reference '%s').")
+                % (line.partner_id.name, line.name))
+        return super(AccountPaymentOrder, self).\
+            _prepare_transaction_snapshot_vals(line, gen_args)
@@ -3,9 +3,22 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+import gzip
+import io
+import re
+import zipfile
+from unittest import mock
+from odoo.addons.account_banking_pain_base.models import (
+    account_payment_order as pain_order_module)
+from odoo.addons.account_banking_pain_base.models.common import (
+    clear_pain_schema_cache, compress_payment_file, convert_to_pain_ascii,
+    get_pain_schema, locked_pain_schema)
+from odoo.addons.account_banking_pain_base.models.pain_render import (
+    render_party)
 from odoo.exceptions import UserError
-from odoo.tools import float_compare
+from odoo.tools import config, float_compare
 from odoo.tests import common
+import threading
 import time
 from lxml import etree
 
@@ -105,6 +118,292 @@ class TestSCT(common.HttpCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.001.003.03'
         self.check_eur_currency_sct()
 
+    def test_pain_001_03_streaming(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.001.001.03',
+            'pain_streaming': True,
+        })
+        self.check_eur_currency_sct()
+
+    def test_pain_001_03_parallel(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.001.001.03',
+            'pain_parallel_processes': 2,
+        })
+        gen_args = {'parallel_processes': 2}
+        job_order_model = self.payment_order_model.with_context(
+            payment_order_job_id=1)
+        with mock.patch.dict(config.options, {'workers': 2}):
+            # Never forked from an HTTP worker
+            self.assertFalse(
+                self.payment_order_model._can_render_in_pool(gen_args))
+            self.assertFalse(job_order_model._can_render_in_pool(
+                {'parallel_processes': 1}))
+            self.assertEqual(
+                job_order_model._can_render_in_pool(gen_args),
+                not job_order_model._get_overridden_generation_hooks())
+        # Nor from a threaded server
+        with mock.patch.dict(config.options, {'workers': 0}):
+            self.assertFalse(job_order_model._can_render_in_pool(gen_args))
+        self.check_eur_currency_sct()
+
+    def test_pain_001_03_pool_tree(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        self.check_pool_rendering()
+
+    def test_pain_001_03_pool_streaming(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.001.001.03',
+            'pain_streaming': True,
+        })
+        self.check_pool_rendering()
+
+    def check_pool_rendering(self):
+        """Check that the file rendered in the pool of a payment order job
+        is the file generated in the current process"""
+        self.payment_mode.payment_method_id.pain_parallel_processes = 2
+        for partner, partner_bank_xmlid, amount, reference in [
+                (self.partner_agrolait,
+                 'account_payment_mode.res_partner_2_iban', 42.0, 'F1341'),
+                (self.partner_agrolait,
+                 'account_payment_mode.res_partner_2_iban', 12.0, 'F1342'),
+                (self.partner_c2c,
+                 'account_payment_mode.res_partner_12_iban', 11.0, 'I1642')]:
+            invoice = self.create_invoice(
+                partner.id, partner_bank_xmlid, self.eur_currency.id,
+                amount, reference)
+            action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        self.assertEqual(len(payment_order.bank_line_ids), 2)
+        serial_file = payment_order.generate_payment_file()[0]
+        job_order = payment_order.with_context(payment_order_job_id=1)
+        # One transaction per job, so that 2 processes are forked
+        with mock.patch.dict(config.options, {'workers': 2}), \
+                mock.patch.object(
+                    pain_order_module, 'PARALLEL_CHUNK_SIZE', 1), \
+                mock.patch.object(
+                    pain_order_module, 'render_in_pool',
+                    wraps=pain_order_module.render_in_pool) as pool_mock:
+            pool_file = job_order.generate_payment_file()[0]
+        self.assertEqual(len(pool_mock.call_args[0][1]), 2)
+        # Only the creation date time may differ
+        creation_re = re.compile(rb'<CreDtTm>[^<]*</CreDtTm>')
+        self.assertEqual(
+            creation_re.sub(b'', pool_file), creation_re.sub(b'', serial_file))
+
+    def test_pain_001_03_sampled_validation(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.001.001.03',
+            'pain_validation': 'sample',
+            'pain_validation_sample_size': 1,
+        })
+        self.check_eur_currency_sct()
+
+    def test_pain_001_03_streaming_sampled_validation(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.001.001.03',
+            'pain_streaming': True,
+            'pain_validation': 'sample',
+            'pain_validation_sample_size': 1,
+        })
+        self.check_eur_currency_sct()
+
+    def _get_three_payment_info_file(self, invalid_index):
+        """Return a valid pain.001.001.03 file with three PmtInf blocks,
+        the block at invalid_index being made invalid"""
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        invoice = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F134%d' % (2 + invalid_index))
+        action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        action = payment_order.open2generated()
+        attachment = self.attachment_model.browse(action['res_id'])
+        xml_root = etree.fromstring(base64.b64decode(attachment.datas))
+        pain_root = xml_root[0]
+        block = pain_root[1]
+        for _i in range(2):
+            pain_root.append(etree.fromstring(etree.tostring(block)))
+        pain_root[1 + invalid_index].find('{*}PmtMtd').text = 'XXX'
+        return etree.tostring(xml_root)
+
+    def test_sampled_validation_skips_blocks(self):
+        gen_args = {
+            'pain_xsd_file':
+                self.payment_mode.payment_method_id.get_xsd_file_path(),
+            'validation': 'sample',
+            'validation_sample_size': 2,
+        }
+        # The first and the last blocks are validated, not the middle one
+        for invalid_index, is_reported in [(1, False), (2, True)]:
+            xml_string = self._get_three_payment_info_file(invalid_index)
+            for validate in [
+                    lambda: self.payment_order_model._validate_xml_root(
+                        etree.fromstring(xml_string), gen_args),
+                    lambda: self.payment_order_model._validate_xml_file(
+                        io.BytesIO(xml_string), 3, gen_args)]:
+                if is_reported:
+                    with self.assertRaises(UserError):
+                        validate()
+                else:
+                    self.assertTrue(validate())
+
+    def test_pain_schema_cache(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        xsd_path = self.payment_mode.payment_method_id.get_xsd_file_path()
+        schema = get_pain_schema(xsd_path)
+        self.assertIs(get_pain_schema(xsd_path), schema)
+        # The schemas are shared with the other threads
+        schemas = []
+        thread = threading.Thread(
+            target=lambda: schemas.append(get_pain_schema(xsd_path)))
+        thread.start()
+        thread.join()
+        self.assertIs(schemas[0], schema)
+        with locked_pain_schema(xsd_path) as locked_schema:
+            self.assertIs(locked_schema, schema)
+        clear_pain_schema_cache()
+        self.assertIsNot(get_pain_schema(xsd_path), schema)
+
+    def test_compress_payment_file(self):
+        xml_string = b'<?xml version="1.0"?><Document/>'
+        self.assertEqual(
+            compress_payment_file(xml_string, 'sct_1.xml', 'compact'),
+            (xml_string, 'sct_1.xml'))
+        data, filename = compress_payment_file(
+            xml_string, 'sct_1.xml', 'gzip')
+        self.assertEqual(filename, 'sct_1.xml.gz')
+        self.assertEqual(gzip.decompress(data), xml_string)
+        data, filename = compress_payment_file(
+            xml_string, 'sct_1.xml', 'zip')
+        self.assertEqual(filename, 'sct_1.zip')
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertEqual(zip_file.read('sct_1.xml'), xml_string)
+        # Streamed files are given as file objects
+        for output_format in ('compact', 'gzip', 'zip'):
+            self.assertEqual(
+                compress_payment_file(
+                    io.BytesIO(xml_string), 'sct_1.xml', output_format)[1],
+                compress_payment_file(
+                    xml_string, 'sct_1.xml', output_format)[1])
+        data, filename = compress_payment_file(
+            io.BytesIO(xml_string), 'sct_1.xml', 'gzip')
+        self.assertEqual(gzip.decompress(data), xml_string)
+        data, filename = compress_payment_file(
+            io.BytesIO(xml_string), 'sct_1.xml', 'zip')
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertEqual(zip_file.read('sct_1.xml'), xml_string)
+
+    def test_pain_001_03_gzip(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        self.payment_mode.pain_output_format = 'gzip'
+        invoice = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1341')
+        action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        action = payment_order.open2generated()
+        attachment = self.attachment_model.browse(action['res_id'])
+        self.assertEqual(attachment.datas_fname[-7:], '.xml.gz')
+        self.assertEqual(attachment.mimetype, 'application/gzip')
+        xml_file = gzip.decompress(base64.b64decode(attachment.datas))
+        self.assertNotIn(b'\n  ', xml_file)
+        xml_root = etree.fromstring(xml_file)
+        namespaces = xml_root.nsmap
+        namespaces['p'] = xml_root.nsmap[None]
+        namespaces.pop(None)
+        self.assertEqual(len(xml_root.xpath(
+            '//p:PmtInf/p:CdtTrfTxInf', namespaces=namespaces)), 1)
+
+    def test_convert_to_pain_ascii(self):
+        for value, expected in [
+                ('Agrolait', 'Agrolait'),
+                ('Société Générale', 'Societe Generale'),
+                ('Müller & Söhne <GmbH>', 'Muller - Sohne -GmbH-'),
+                ('Łódź_#1', 'Lodz--1'),
+                ('Société Générale', 'Societe Generale')]:
+            self.assertEqual(convert_to_pain_ascii(value), expected)
+
+    def test_render_party_snapshot(self):
+        gen_args = {
+            'bic_xml_tag': 'BICFI',
+            'name_maxsize': 140,
+            'convert_to_ascii': True,
+            'payment_method': 'TRF',
+            'pain_flavor': 'pain.001.001.03',
+        }
+        partner_bank = self.env.ref('account_payment_mode.res_partner_2_iban')
+        hook_node = etree.Element('CdtTrfTxInf')
+        self.payment_order_model.generate_party_block(
+            hook_node, 'Cdtr', 'C', partner_bank, gen_args)
+        render_node = etree.Element('CdtTrfTxInf')
+        render_party(
+            render_node, 'Cdtr', 'C',
+            self.payment_order_model._snapshot_bank_account(
+                partner_bank, gen_args), gen_args)
+        self.assertEqual(
+            etree.tostring(render_node), etree.tostring(hook_node))
+
+    def test_party_block_cache(self):
+        gen_args = {
+            'bic_xml_tag': 'BICFI',
+            'name_maxsize': 140,
+            'convert_to_ascii': True,
+            'payment_method': 'TRF',
+            'pain_flavor': 'pain.001.001.03',
+        }
+        partner_bank = self.env.ref('account_payment_mode.res_partner_2_iban')
+        nodes = [etree.Element('CdtTrfTxInf') for i in range(2)]
+        for node in nodes:
+            self.payment_order_model.generate_party_block(
+                node, 'Cdtr', 'C', partner_bank, gen_args)
+        self.assertEqual(etree.tostring(nodes[0]), etree.tostring(nodes[1]))
+        cache = gen_args['party_block_cache']
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_party_block_cache_bank_line(self):
+        gen_args = {
+            'bic_xml_tag': 'BICFI',
+            'name_maxsize': 140,
+            'convert_to_ascii': True,
+            'payment_method': 'TRF',
+            'pain_flavor': 'pain.001.001.03',
+        }
+        partner_bank = self.env.ref('account_payment_mode.res_partner_2_iban')
+        bank_lines = [
+            self.bank_line_model.new({'name': name})
+            for name in ('L0001', 'L0002')]
+        order_class = type(self.payment_order_model)
+        generate_party_agent = order_class.generate_party_agent
+
+        def generate_line_party_agent(
+                self, parent_node, party_type, order, partner_bank, gen_args,
+                bank_line=None):
+            res = generate_party_agent(
+                self, parent_node, party_type, order, partner_bank,
+                gen_args, bank_line=bank_line)
+            if bank_line:
+                etree.SubElement(parent_node, 'AgtLine').text = bank_line.name
+            return res
+
+        with mock.patch.object(
+                order_class, 'generate_party_agent',
+                generate_line_party_agent):
+            nodes = [etree.Element('CdtTrfTxInf') for line in bank_lines]
+            for node, bank_line in zip(nodes, bank_lines):
+                self.payment_order_model.generate_party_block(
+                    node, 'Cdtr', 'C', partner_bank, gen_args,
+                    bank_line=bank_line)
+        self.assertEqual(
+            [node.findtext('AgtLine') for node in nodes], ['L0001', 'L0002'])
+        cache = gen_args['party_block_cache']
+        self.assertEqual((cache.misses, cache.hits), (0, 0))
+
     def check_eur_currency_sct(self):
         invoice1 = self.create_invoice(
             self.partner_agrolait.id,
@@ -153,6 +452,9 @@ class TestSCT(common.HttpCase):
         self.payment_order.draft2open()
         self.assertEqual(self.payment_order.state, 'open')
         self.assertEqual(self.payment_order.sepa, True)
+        grouping_keys = pay_lines._get_grouping_keys()
+        self.assertEqual(len(set(grouping_keys.values())), 1)
+        self.assertIsInstance(pay_lines[0].payment_line_hashcode(), str)
         bank_lines = self.bank_line_model.search([
             ('partner_id', '=', self.partner_agrolait.id)])
         self.assertEqual(len(bank_lines), 1)
@@ -230,6 +532,16 @@ class TestSCT(common.HttpCase):
         self.payment_order.draft2open()
         self.assertEqual(self.payment_order.state, 'open')
         self.assertEqual(self.payment_order.sepa, False)
+        # Each order of a batch gets its own value
+        eur_order = self.payment_order_model.create({
+            'payment_type': 'outbound',
+            'payment_mode_id': self.payment_mode.id,
+            'journal_id': self.bank_journal.id,
+        })
+        orders = self.payment_order | eur_order
+        orders.invalidate_cache(['sepa'])
+        self.assertEqual(orders.mapped('sepa'), [False, True])
+        eur_order.unlink()
         bank_lines = self.bank_line_model.search([
             ('partner_id', '=', self.partner_asus.id)])
         self.assertEqual(len(bank_lines), 1)
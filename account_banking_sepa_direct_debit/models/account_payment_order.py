@@ -4,9 +4,77 @@
 
 from odoo import _, api, exceptions, fields, models
 from odoo.exceptions import UserError
+from odoo.addons.account_banking_pain_base.models.pain_render import (
+    prepare_value, render_party, render_remittance_info)
+from odoo.addons.account_banking_pain_base.models.pain_snapshot import (
+    PainSnapshot, PainTransaction)
 from lxml import etree
 
 
+class PainMandate(PainSnapshot):
+    """account.banking.mandate, for the direct debit transactions"""
+
+    __slots__ = ('unique_mandate_reference', 'signature_date', 'amendment')
+
+
+class SddTransaction(PainTransaction):
+    """bank.payment.line of a direct debit, with its mandate"""
+
+    __slots__ = ('mandate', )
+
+
+def render_sdd_transaction(parent_node, transaction, render_args):
+    """Render the DrctDbtTxInf block of a transaction from its snapshot,
+    as generate_payment_file() does from the bank payment line"""
+    dd_transaction_info = etree.SubElement(parent_node, 'DrctDbtTxInf')
+    payment_identification = etree.SubElement(dd_transaction_info, 'PmtId')
+    instruction_identification = etree.SubElement(
+        payment_identification, 'InstrId')
+    instruction_identification.text = prepare_value(
+        'Instruction Identification', transaction.name, 35, render_args)
+    end2end_identification = etree.SubElement(
+        payment_identification, 'EndToEndId')
+    end2end_identification.text = prepare_value(
+        'End to End Identification', transaction.name, 35, render_args)
+    currency_name = prepare_value(
+        'Currency Code', transaction.currency, 3, render_args)
+    instructed_amount = etree.SubElement(
+        dd_transaction_info, 'InstdAmt', Ccy=currency_name)
+    instructed_amount.text = '%.2f' % transaction.amount
+    dd_transaction = etree.SubElement(dd_transaction_info, 'DrctDbtTx')
+    mandate_related_info = etree.SubElement(dd_transaction, 'MndtRltdInf')
+    mandate_identification = etree.SubElement(
+        mandate_related_info, 'MndtId')
+    mandate_identification.text = prepare_value(
+        'Unique Mandate Reference',
+        transaction.mandate.unique_mandate_reference, 35, render_args)
+    mandate_signature_date = etree.SubElement(
+        mandate_related_info, 'DtOfSgntr')
+    mandate_signature_date.text = prepare_value(
+        'Mandate Signature Date', transaction.mandate.signature_date, 10,
+        render_args)
+    if transaction.mandate.amendment:
+        amendment_indicator = etree.SubElement(
+            mandate_related_info, 'AmdmntInd')
+        amendment_indicator.text = 'true'
+        amendment_info_details = etree.SubElement(
+            mandate_related_info, 'AmdmntInfDtls')
+        ori_debtor_account = etree.SubElement(
+            amendment_info_details, 'OrgnlDbtrAcct')
+        ori_debtor_account_id = etree.SubElement(ori_debtor_account, 'Id')
+        ori_debtor_agent_other = etree.SubElement(
+            ori_debtor_account_id, 'Othr')
+        ori_debtor_agent_other_id = etree.SubElement(
+            ori_debtor_agent_other, 'Id')
+        ori_debtor_agent_other_id.text = 'SMNDA'
+    render_party(
+        dd_transaction_info, 'Dbtr', 'C', transaction.account, render_args)
+    if transaction.purpose:
+        purpose = etree.SubElement(dd_transaction_info, 'Purp')
+        etree.SubElement(purpose, 'Cd').text = transaction.purpose
+    render_remittance_info(dd_transaction_info, transaction, render_args)
+
+
 class AccountPaymentOrder(models.Model):
     _inherit = 'account.payment.order'
 
@@ -16,6 +84,7 @@ class AccountPaymentOrder(models.Model):
         self.ensure_one()
         if self.payment_method_id.code != 'sepa_direct_debit':
             return super(AccountPaymentOrder, self).generate_payment_file()
+        self._prefetch_payment_file_data()
         pain_flavor = self.payment_method_id.pain_version
         # We use pain_flavor.startswith('pain.008.001.xx')
         # to support country-specific extensions such as
@@ -52,6 +121,11 @@ class AccountPaymentOrder(models.Model):
             'file_prefix': 'sdd_',
             'pain_flavor': pain_flavor,
             'pain_xsd_file': xsd_file,
+            'streaming': pay_method.pain_streaming,
+            'validation': pay_method.pain_validation,
+            'validation_sample_size': pay_method.pain_validation_sample_size,
+            'parallel_processes': pay_method.pain_parallel_processes,
+            'output_format': self.payment_mode_id.pain_output_format,
         }
         nsmap = self.generate_pain_nsmap()
         attrib = self.generate_pain_attrib()
@@ -95,9 +169,23 @@ class AccountPaymentOrder(models.Model):
                 lines_per_group[key].append(line)
             else:
                 lines_per_group[key] = [line]
+        # The control sums are computed before generating the blocks, as the
+        # streaming writer needs complete headers
+        for lines in lines_per_group.values():
+            for line in lines:
+                amount_control_sum_a += line.amount_currency
+        nb_of_transactions_a.text = str(transactions_count_a)
+        control_sum_a.text = '%.2f' % amount_control_sum_a
+        writer = self.generate_pain_writer(xml_root, gen_args)
+        groups = list(lines_per_group.items())
+        fragments = None
+        if self._can_render_in_pool(gen_args):
+            fragments = self._render_transactions_in_pool(
+                render_sdd_transaction, [lines for key, lines in groups],
+                gen_args)
 
-        for (requested_date, priority, categ_purpose, sequence_type, scheme),\
-                lines in list(lines_per_group.items()):
+        for index, ((requested_date, priority, categ_purpose, sequence_type,
+                     scheme), lines) in enumerate(groups):
             requested_date = fields.Date.to_string(requested_date)
             # B. Payment info
             payment_info, nb_of_transactions_b, control_sum_b = \
@@ -131,10 +219,17 @@ class AccountPaymentOrder(models.Model):
                 'self.payment_mode_id.sepa_creditor_identifier or '
                 'self.company_id.sepa_creditor_identifier',
                 'SEPA Creditor Identifier', {'self': self}, 'SEPA', gen_args)
-            transactions_count_b = 0
             amount_control_sum_b = 0.0
             for line in lines:
-                transactions_count_b += 1
+                amount_control_sum_b += line.amount_currency
+            nb_of_transactions_b.text = str(len(lines))
+            control_sum_b.text = '%.2f' % amount_control_sum_b
+            writer.start_payment_info(payment_info)
+            if fragments is not None:
+                writer.add_transactions_xml(payment_info, fragments[index])
+                # Already rendered in the pool
+                lines = []
+            for line in lines:
                 # C. Direct Debit Transaction Info
                 dd_transaction_info = etree.SubElement(
                     payment_info, 'DrctDbtTxInf')
@@ -156,8 +251,6 @@ class AccountPaymentOrder(models.Model):
                 instructed_amount = etree.SubElement(
                     dd_transaction_info, 'InstdAmt', Ccy=currency_name)
                 instructed_amount.text = '%.2f' % line.amount_currency
-                amount_control_sum_a += line.amount_currency
-                amount_control_sum_b += line.amount_currency
                 dd_transaction = etree.SubElement(
                     dd_transaction_info, 'DrctDbtTx')
                 mandate_related_info = etree.SubElement(
@@ -210,15 +303,45 @@ class AccountPaymentOrder(models.Model):
 
                 self.generate_remittance_info_block(
                     dd_transaction_info, line, gen_args)
-
-            nb_of_transactions_b.text = str(transactions_count_b)
-            control_sum_b.text = '%.2f' % amount_control_sum_b
-        nb_of_transactions_a.text = str(transactions_count_a)
-        control_sum_a.text = '%.2f' % amount_control_sum_a
+                writer.add_transaction(payment_info, dd_transaction_info)
+            writer.end_payment_info(payment_info)
 
         return self.finalize_sepa_file_creation(
             xml_root, gen_args)
 
+    @api.model
+    def _snapshot_mandate(self, mandate, gen_args):
+        snapshots = gen_args.setdefault('mandate_snapshots', {})
+        if mandate.id not in snapshots:
+            snapshots[mandate.id] = PainMandate(
+                unique_mandate_reference=mandate.unique_mandate_reference,
+                signature_date=fields.Date.to_string(mandate.signature_date),
+                # Same condition as the FRST sequence type of the line
+                amendment=bool(
+                    mandate.type == 'recurrent' and
+                    mandate.recurrent_sequence_type == 'first' and
+                    mandate.last_debit_date),
+            )
+        return snapshots[mandate.id]
+
+    @api.model
+    def _snapshot_transaction(self, line, gen_args):
+        if gen_args['payment_method'] != 'DD':
+            return super(AccountPaymentOrder, self)._snapshot_transaction(
+                line, gen_args)
+        return SddTransaction(
+            mandate=self._snapshot_mandate(line.mandate_id, gen_args),
+            **self._prepare_transaction_snapshot_vals(line, gen_args))
+
+    @api.multi
+    def _prefetch_payment_file_data(self):
+        res = super(AccountPaymentOrder, self)._prefetch_payment_file_data()
+        mandates = res['payment_lines'].mapped('mandate_id')
+        mandates.mapped('unique_mandate_reference')
+        res['bank_lines'].mapped('mandate_id')
+        res['mandates'] = mandates
+        return res
+
     @api.multi
     def generated2uploaded(self):
         """Write 'last debit date' on mandates
@@ -231,7 +354,9 @@ class AccountPaymentOrder(models.Model):
         # of the account move per sequence_type
         res = super(AccountPaymentOrder, self).generated2uploaded()
         abmo = self.env['account.banking.mandate']
-        for order in self:
+        # The orders queued in a background job are not uploaded yet: their
+        # mandates are updated when the job calls this method again
+        for order in self.filtered(lambda order: order.state == 'uploaded'):
             to_expire_mandates = abmo.browse([])
             first_mandates = abmo.browse([])
             all_mandates = abmo.browse([])
@@ -8,7 +8,7 @@ class BankPaymentLine(models.Model):
     _inherit = 'bank.payment.line'
 
     @api.multi
-    def move_line_offsetting_account_hashcode(self):
+    def _get_move_line_offsetting_account_keys(self):
         """
         From my experience, even when you ask several direct debits
         at the same date with enough delay, you will have several credits
@@ -16,7 +16,8 @@ class BankPaymentLine(models.Model):
         So we split the transfer move lines by mandate type, so easier
         reconciliation of the bank statement.
         """
-        hashcode = super(BankPaymentLine, self).\
-            move_line_offsetting_account_hashcode()
-        hashcode += '-' + str(self.mandate_id.recurrent_sequence_type)
-        return hashcode
+        keys = super(BankPaymentLine, self).\
+            _get_move_line_offsetting_account_keys()
+        for bline in self:
+            keys[bline.id] += (bline.mandate_id.recurrent_sequence_type, )
+        return keys
@@ -3,8 +3,12 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+import re
+from unittest import mock
+from odoo.addons.account_banking_pain_base.models import (
+    account_payment_order as pain_order_module)
 from odoo.tests import common
-from odoo.tools import float_compare
+from odoo.tools import config, float_compare
 import time
 from lxml import etree
 
@@ -121,6 +125,117 @@ class TestSDD(common.HttpCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.008.001.04'
         self.check_sdd()
 
+    def test_pain_008_001_02_streaming(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.008.001.02',
+            'pain_streaming': True,
+        })
+        self.check_sdd()
+
+    def test_pain_008_001_02_parallel(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.008.001.02',
+            'pain_parallel_processes': 2,
+        })
+        self.check_sdd()
+
+    def test_pain_008_001_02_pool_tree(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
+        self.check_pool_rendering()
+
+    def test_pain_008_001_02_pool_streaming(self):
+        self.payment_mode.payment_method_id.write({
+            'pain_version': 'pain.008.001.02',
+            'pain_streaming': True,
+        })
+        self.check_pool_rendering()
+
+    def check_pool_rendering(self):
+        """Check that the file rendered in the pool of a payment order job
+        is the file generated in the current process"""
+        self.payment_mode.payment_method_id.pain_parallel_processes = 2
+        self.mandate2.recurrent_sequence_type = 'first'
+        self.mandate12.type = 'oneoff'
+        invoices = self.create_invoice(
+            self.partner_agrolait.id, self.mandate2, 42.0,
+        ) + self.create_invoice(
+            self.partner_c2c.id, self.mandate12, 11.0,
+        )
+        for inv in invoices:
+            action = inv.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        self.assertEqual(len(payment_order.bank_line_ids), 2)
+        serial_file = payment_order.generate_payment_file()[0]
+        job_order = payment_order.with_context(payment_order_job_id=1)
+        # One job per sequence type, so that 2 processes are forked
+        with mock.patch.dict(config.options, {'workers': 2}), \
+                mock.patch.object(
+                    pain_order_module, 'render_in_pool',
+                    wraps=pain_order_module.render_in_pool) as pool_mock:
+            pool_file = job_order.generate_payment_file()[0]
+        self.assertEqual(len(pool_mock.call_args[0][1]), 2)
+        # Only the creation date time may differ
+        creation_re = re.compile(rb'<CreDtTm>[^<]*</CreDtTm>')
+        self.assertEqual(
+            creation_re.sub(b'', pool_file), creation_re.sub(b'', serial_file))
+
+    def test_generate_payment_file_query_count(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
+        self.mandate2.recurrent_sequence_type = 'first'
+        self.mandate12.write({
+            'type': 'recurrent',
+            'recurrent_sequence_type': 'first',
+        })
+        invoice = self.create_invoice(
+            self.partner_agrolait.id, self.mandate2, 42.0)
+        action = invoice.create_account_payment_line()
+        order1 = self.payment_order_model.browse(action['res_id'])
+        order1.draft2open()
+        invoices = self.create_invoice(
+            self.partner_c2c.id, self.mandate12, 11.0,
+        ) + self.create_invoice(
+            self.partner_agrolait.id, self.mandate2, 12.0,
+        )
+        for inv in invoices:
+            action = inv.create_account_payment_line()
+        order2 = self.payment_order_model.browse(action['res_id'])
+        order2.draft2open()
+        self.assertEqual(len(order1.bank_line_ids), 1)
+        self.assertEqual(len(order2.bank_line_ids), 2)
+        # The deprecated hashcode still has the mandate sequence type
+        hashcode = order1.bank_line_ids.move_line_offsetting_account_hashcode()
+        self.assertTrue(hashcode.endswith('-first'))
+        orders = order1 | order2
+        # Warm up the schema and ormcache caches
+        for order in orders:
+            order.generate_payment_file()
+        query_counts = []
+        for order in orders:
+            self.env.invalidate_all()
+            sql_log_count = self.cr.sql_log_count
+            order.generate_payment_file()
+            query_counts.append(self.cr.sql_log_count - sql_log_count)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_background_upload_mandates(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
+        self.mandate2.recurrent_sequence_type = 'first'
+        invoice = self.create_invoice(
+            self.partner_agrolait.id, self.mandate2, 42.0)
+        action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        payment_order.open2generated()
+        self.payment_mode.background_threshold = 1
+        payment_order.generated2uploaded()
+        # The mandates are updated by the job, once the order is uploaded
+        self.assertEqual(payment_order.state, 'generated')
+        self.assertEqual(self.mandate2.recurrent_sequence_type, 'first')
+        payment_order.job_ids._run(commit=False)
+        self.assertEqual(payment_order.state, 'uploaded')
+        self.assertEqual(self.mandate2.recurrent_sequence_type, 'recurring')
+
     def check_sdd(self):
         self.mandate2.recurrent_sequence_type = 'first'
         invoice1 = self.create_invoice(
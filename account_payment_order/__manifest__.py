@@ -8,7 +8,7 @@
 
 {
     'name': 'Account Payment Order',
-    'version': '12.0.1.6.1',
+    'version': '12.0.1.8.0',
     'license': 'AGPL-3',
     'author': "ACSONE SA/NV, "
               "Therp BV, "
@@ -29,12 +29,14 @@
         'wizard/account_invoice_payment_line_multi_view.xml',
         'views/account_payment_mode.xml',
         'views/account_payment_order.xml',
+        'views/account_payment_order_job.xml',
         'views/account_payment_line.xml',
         'views/bank_payment_line.xml',
         'views/account_move_line.xml',
         'views/ir_attachment.xml',
         'views/account_invoice_view.xml',
         'data/payment_seq.xml',
+        'data/payment_order_job_cron.xml',
         'report/print_account_payment_order.xml',
         'report/account_payment_order.xml',
     ],
@@ -0,0 +1,24 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # Create and fill the new stored field in SQL, instead of letting the
+    # ORM compute it for every journal item
+    if openupgrade.column_exists(
+            env.cr, 'account_move_line', 'in_pending_payment_order'):
+        return
+    openupgrade.logged_query(
+        env.cr, """
+        ALTER TABLE account_move_line
+        ADD COLUMN in_pending_payment_order BOOLEAN""")
+    openupgrade.logged_query(
+        env.cr, """
+        UPDATE account_move_line aml
+        SET in_pending_payment_order = TRUE
+        WHERE EXISTS (
+            SELECT 1 FROM account_payment_line apl
+            WHERE apl.move_line_id = aml.id
+            AND apl.state IN ('draft', 'open', 'generated'))""")
@@ -9,3 +9,6 @@ from . import res_bank
 from . import account_payment_method
 from . import account_journal
 from . import account_payment
+from . import ir_sequence
+from . import account_payment_order_job
+from . import res_currency
@@ -66,8 +66,11 @@ class AccountInvoice(models.Model):
     @api.multi
     def create_account_payment_line(self):
         apoo = self.env['account.payment.order']
-        result_payorder_ids = []
-        action_payment_type = 'debit'
+        amlo = self.env['account.move.line']
+        # Collect the applicable lines of all the invoices per payment mode
+        mline_ids_per_mode = {}  # key = payment mode id
+        invoice_per_mode = {}  # the invoice preparing the new order
+        counts_per_invoice = {}  # key = invoice, value = {mode id: count}
         for inv in self:
             if inv.state != 'open':
                 raise UserError(_(
@@ -79,8 +82,7 @@ class AccountInvoice(models.Model):
                 lambda x: (
                     not x.reconciled and x.payment_mode_id.payment_order_ok and
                     x.account_id.internal_type in ('receivable', 'payable') and
-                    not any(p_state in ('draft', 'open', 'generated')
-                            for p_state in x.payment_line_ids.mapped('state'))
+                    not x.in_pending_payment_order
                 )
             )
             if not applicable_lines:
@@ -88,52 +90,67 @@ class AccountInvoice(models.Model):
                     'No Payment Line created for invoice %s because '
                     'it already exists or because this invoice is '
                     'already paid.') % inv.number)
-            payment_modes = applicable_lines.mapped('payment_mode_id')
-            if not payment_modes:
-                raise UserError(_(
-                    "No Payment Mode on invoice %s") % inv.number)
-            for payment_mode in payment_modes:
-                payorder = apoo.search([
-                    ('payment_mode_id', '=', payment_mode.id),
-                    ('state', '=', 'draft')
-                ], limit=1)
-                new_payorder = False
-                if not payorder:
-                    payorder = apoo.create(inv._prepare_new_payment_order(
-                        payment_mode
-                    ))
-                    new_payorder = True
-                result_payorder_ids.append(payorder.id)
-                action_payment_type = payorder.payment_type
-                count = 0
-                for line in applicable_lines.filtered(
-                    lambda x: x.payment_mode_id == payment_mode
-                ):
-                    line.create_payment_line_from_move_line(payorder)
-                    count += 1
-                if new_payorder:
-                    inv.message_post(body=_(
+            counts = counts_per_invoice[inv] = {}
+            for line in applicable_lines:
+                mode_id = line.payment_mode_id.id
+                mline_ids_per_mode.setdefault(mode_id, []).append(line.id)
+                invoice_per_mode.setdefault(mode_id, inv)
+                counts[mode_id] = counts.get(mode_id, 0) + 1
+        # One draft payment order per payment mode, existing or new
+        payorders = {}  # key = payment mode id
+        for payorder in apoo.search([
+                ('payment_mode_id', 'in', list(mline_ids_per_mode)),
+                ('state', '=', 'draft')]):
+            payorders.setdefault(payorder.payment_mode_id.id, payorder)
+        new_mode_ids = [
+            mode_id for mode_id in mline_ids_per_mode
+            if mode_id not in payorders]
+        new_payorders = apoo.create([
+            invoice_per_mode[mode_id]._prepare_new_payment_order(
+                self.env['account.payment.mode'].browse(mode_id))
+            for mode_id in new_mode_ids])
+        payorders.update(zip(new_mode_ids, new_payorders))
+        # All the payment lines at once
+        vals_list = []
+        for mode_id, mline_ids in mline_ids_per_mode.items():
+            vals_list += amlo.browse(mline_ids)._prepare_payment_lines_vals(
+                payorders[mode_id])
+        self.env['account.payment.line'].create(vals_list)
+        # One message per invoice. Only the invoice the new order was
+        # prepared for created it, as when the invoices are added one by one
+        created_by = {
+            mode_id: invoice_per_mode[mode_id] for mode_id in new_mode_ids}
+        for inv, counts in counts_per_invoice.items():
+            messages = []
+            for mode_id, count in counts.items():
+                payorder = payorders[mode_id]
+                if created_by.get(mode_id) == inv:
+                    messages.append(_(
                         '%d payment lines added to the new draft payment '
                         'order %s which has been automatically created.')
                         % (count, payorder.name))
                 else:
-                    inv.message_post(body=_(
+                    messages.append(_(
                         '%d payment lines added to the existing draft '
                         'payment order %s.')
                         % (count, payorder.name))
+            inv.message_post(body='<br/>'.join(messages))
+        result_payorders = apoo.browse(
+            [payorder.id for payorder in payorders.values()])
+        action_payment_type = result_payorders[:1].payment_type or 'debit'
         action = self.env['ir.actions.act_window'].for_xml_id(
             'account_payment_order',
             'account_payment_order_%s_action' % action_payment_type)
-        if len(result_payorder_ids) == 1:
+        if len(result_payorders) == 1:
             action.update({
                 'view_mode': 'form,tree,pivot,graph',
-                'res_id': payorder.id,
+                'res_id': result_payorders.id,
                 'views': False,
                 })
         else:
             action.update({
                 'view_mode': 'tree,form,pivot,graph',
-                'domain': "[('id', 'in', %s)]" % result_payorder_ids,
+                'domain': "[('id', 'in', %s)]" % result_payorders.ids,
                 'views': False,
                 })
         return action
@@ -24,6 +24,19 @@ class AccountMoveLine(models.Model):
         inverse_name='move_line_id',
         string="Payment lines",
     )
+    in_pending_payment_order = fields.Boolean(
+        compute='_compute_in_pending_payment_order', store=True, index=True,
+        string='In a Pending Payment Order',
+        help="The move line is in a payment order that is neither "
+        "cancelled, uploaded nor done.")
+
+    @api.multi
+    @api.depends('payment_line_ids.state')
+    def _compute_in_pending_payment_order(self):
+        for line in self:
+            line.in_pending_payment_order = any(
+                state in ('draft', 'open', 'generated')
+                for state in line.payment_line_ids.mapped('state'))
 
     @api.multi
     def _prepare_payment_line_vals(self, payment_order):
@@ -74,12 +87,23 @@ class AccountMoveLine(models.Model):
             }
         return vals
 
+    @api.multi
+    def _prepare_payment_lines_vals(self, payment_order):
+        """Return the values of the payment lines of the move lines, in
+        the same order, reading their related records for the whole
+        recordset at once before calling _prepare_payment_line_vals() for
+        each of them"""
+        assert payment_order, 'Missing payment order'
+        self.mapped('move_id')
+        self.mapped('invoice_id')
+        self.mapped('partner_id.bank_ids')
+        return [
+            mline._prepare_payment_line_vals(payment_order) for mline in self]
+
     @api.multi
     def create_payment_line_from_move_line(self, payment_order):
-        vals_list = []
-        for mline in self:
-            vals_list.append(mline._prepare_payment_line_vals(payment_order))
-        return self.env['account.payment.line'].create(vals_list)
+        return self.env['account.payment.line'].create(
+            self._prepare_payment_lines_vals(payment_order))
 
     @api.model
     def fields_view_get(self, view_id=None, view_type='form', toolbar=False,
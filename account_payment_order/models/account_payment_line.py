@@ -39,7 +39,7 @@ class AccountPaymentLine(models.Model):
         string="Amount", currency_field='currency_id')
     amount_company_currency = fields.Monetary(
         compute='_compute_amount_company_currency',
-        string='Amount in Company Currency', readonly=True,
+        string='Amount in Company Currency', readonly=True, store=True,
         currency_field='company_currency_id')  # v8 field : amount
     partner_id = fields.Many2one(
         'res.partner', string='Partner', required=True,
@@ -67,41 +67,97 @@ class AccountPaymentLine(models.Model):
         'in the same company!'
         )]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        vals_to_name = [
+            vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        names = self.env['ir.sequence'].next_by_code_batch(
+            'account.payment.line', len(vals_to_name))
+        for vals, name in zip(vals_to_name, names):
+            vals['name'] = name or 'New'
+        return super(AccountPaymentLine, self).create(vals_list)
+
     @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code(
-                'account.payment.line') or 'New'
-        return super(AccountPaymentLine, self).create(vals)
+    def _sum_per_group(self, amount_field, group_field, group_ids):
+        """Sum amount_field of the payment lines per value of group_field,
+        with one grouped SQL query instead of reading all the lines
+        @return: {group id: sum}, with 0.0 for the groups without lines
+        """
+        sums = dict.fromkeys(group_ids, 0.0)
+        if not group_ids:
+            return sums
+        groups = self.read_group(
+            [(group_field, 'in', list(group_ids))],
+            [group_field, amount_field], [group_field])
+        for group in groups:
+            sums[group[group_field][0]] = group[amount_field] or 0.0
+        return sums
 
     @api.multi
     @api.depends(
         'amount_currency', 'currency_id', 'company_currency_id', 'date')
     def _compute_amount_company_currency(self):
+        lines = self.filtered(
+            lambda line: line.currency_id and line.company_currency_id)
+        today = fields.Date.today()
+        amounts = self.env['res.currency']._convert_batch([(
+            line.amount_currency, line.currency_id, line.company_currency_id,
+            line.company_id, line.date or today) for line in lines])
+        for line, amount in zip(lines, amounts):
+            line.amount_company_currency = amount
+
+    @api.multi
+    def _get_grouping_keys(self):
+        """Return the keys the payment lines are grouped by in bank
+        payment lines, for the whole recordset in one pass
+        If an installed module still overrides payment_line_hashcode(),
+        the keys are its hashcodes.
+        @return: dict {payment line id: tuple of ids and plain values}
+        """
+        if type(self).payment_line_hashcode is not \
+                AccountPaymentLine.payment_line_hashcode and \
+                not self.env.context.get('skip_deprecated_hashcode'):
+            return {line.id: (line.payment_line_hashcode(), ) for line in self}
+        return self._get_default_grouping_keys()
+
+    @api.multi
+    def _get_default_grouping_keys(self):
+        bplo = self.env['bank.payment.line']
+        same_fields = [
+            (name, self._fields[name].type)
+            for name in bplo.same_fields_payment_line_and_bank_payment_line()]
+        keys = {}
         for line in self:
-            if line.currency_id and line.company_currency_id:
-                line.amount_company_currency = line.currency_id._convert(
-                    line.amount_currency, line.company_currency_id,
-                    line.company_id, line.date or fields.Date.today(),
-                )
+            values = []
+            for name, field_type in same_fields:
+                value = line[name]
+                if field_type == 'many2one':
+                    value = value.id
+                elif field_type in ('one2many', 'many2many'):
+                    value = tuple(value.ids)
+                values.append(value)
+            # Don't group the payment lines that are attached to the same
+            # supplier but to move lines with different accounts (very
+            # unlikely), for easier generation/comprehension of the
+            # transfer move
+            values.append(line.move_line_id.account_id.id)
+            # Don't group the payment lines that use a structured
+            # communication otherwise it would break the structured
+            # communication system !
+            if line.communication_type != 'normal':
+                values.append(line.id)
+            keys[line.id] = tuple(values)
+        return keys
 
     @api.multi
     def payment_line_hashcode(self):
+        """Deprecated: inherit _get_grouping_keys() instead, which groups
+        the whole recordset in one pass. Still called for each line when
+        it is overridden."""
         self.ensure_one()
-        bplo = self.env['bank.payment.line']
-        values = []
-        for field in bplo.same_fields_payment_line_and_bank_payment_line():
-            values.append(str(self[field]))
-        # Don't group the payment lines that are attached to the same supplier
-        # but to move lines with different accounts (very unlikely),
-        # for easier generation/comprehension of the transfer move
-        values.append(str(self.move_line_id.account_id or False))
-        # Don't group the payment lines that use a structured communication
-        # otherwise it would break the structured communication system !
-        if self.communication_type != 'normal':
-            values.append(str(self.id))
-        hashcode = '-'.join(values)
-        return hashcode
+        key = self.with_context(skip_deprecated_hashcode=True).\
+            _get_grouping_keys()[self.id]
+        return '-'.join(str(value) for value in key)
 
     @api.onchange('partner_id')
     def partner_id_change(self):
@@ -113,7 +169,9 @@ class AccountPaymentLine(models.Model):
     @api.onchange('move_line_id')
     def move_line_id_change(self):
         if self.move_line_id:
-            vals = self.move_line_id._prepare_payment_line_vals(self.order_id)
+            # Through the batch method, which inherited modules complete
+            vals = self.move_line_id._prepare_payment_lines_vals(
+                self.order_id)[0]
             vals.pop('order_id')
             for field, value in vals.items():
                 self[field] = value
@@ -48,6 +48,12 @@ class AccountPaymentMode(models.Model):
         ('due', 'Due Date'),
         ('fixed', 'Fixed Date'),
         ], string='Default Payment Execution Date')
+    background_threshold = fields.Integer(
+        string='Background Processing Threshold',
+        help="Payment orders with at least this number of transactions are "
+        "confirmed, generated and marked as uploaded by a background job, "
+        "instead of during the request of the user. 0 disables the "
+        "background processing.")
     group_lines = fields.Boolean(
         string="Group Transactions in Payment Orders", default=True,
         help="If this mark is checked, the transaction lines of the "
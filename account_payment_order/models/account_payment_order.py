@@ -8,6 +8,9 @@ import base64
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
 
+# Number of bank payment lines created at once when confirming an order
+BANK_LINE_CHUNK_SIZE = 1000
+
 
 class AccountPaymentOrder(models.Model):
     _name = 'account.payment.order'
@@ -100,6 +103,19 @@ class AccountPaymentOrder(models.Model):
         'account.move', 'payment_order_id', string='Journal Entries',
         readonly=True)
     description = fields.Char()
+    job_ids = fields.One2many(
+        'account.payment.order.job', 'order_id', string='Background Jobs',
+        readonly=True)
+    job_active = fields.Boolean(
+        compute='_compute_job_active', string='Processed in Background')
+
+    @api.multi
+    @api.depends('job_ids.state')
+    def _compute_job_active(self):
+        for order in self:
+            order.job_active = any(
+                state in ('pending', 'running')
+                for state in order.job_ids.mapped('state'))
 
     @api.depends('payment_mode_id')
     def _compute_allowed_journal_ids(self):
@@ -149,7 +165,20 @@ class AccountPaymentOrder(models.Model):
     @api.depends(
         'payment_line_ids', 'payment_line_ids.amount_company_currency')
     def _compute_total(self):
-        for rec in self:
+        # The orders whose lines aren't all saved with their amount are
+        # summed in Python, the others with one SQL aggregation
+        line_model = self.env['account.payment.line']
+        pending_lines = self.env.field_todo(
+            line_model._fields['amount_company_currency'])
+        python_orders = self.filtered(
+            lambda order: isinstance(order.id, models.NewId))
+        python_orders |= pending_lines.mapped('order_id') & self
+        sql_orders = self - python_orders
+        totals = line_model._sum_per_group(
+            'amount_company_currency', 'order_id', sql_orders.ids)
+        for rec in sql_orders:
+            rec.total_company_currency = totals[rec.id]
+        for rec in python_orders:
             rec.total_company_currency = sum(
                 rec.mapped('payment_line_ids.amount_company_currency') or
                 [0.0])
@@ -160,12 +189,17 @@ class AccountPaymentOrder(models.Model):
         for order in self:
             order.bank_line_count = len(order.bank_line_ids)
 
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code(
-                'account.payment.order') or 'New'
-        if vals.get('payment_mode_id'):
+    @api.model_create_multi
+    def create(self, vals_list):
+        vals_to_name = [
+            vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        names = self.env['ir.sequence'].next_by_code_batch(
+            'account.payment.order', len(vals_to_name))
+        for vals, name in zip(vals_to_name, names):
+            vals['name'] = name or 'New'
+        for vals in vals_list:
+            if not vals.get('payment_mode_id'):
+                continue
             payment_mode = self.env['account.payment.mode'].browse(
                 vals['payment_mode_id'])
             vals['payment_type'] = payment_mode.payment_type
@@ -175,7 +209,7 @@ class AccountPaymentOrder(models.Model):
                     not vals.get('date_prefered') and
                     payment_mode.default_date_prefered):
                 vals['date_prefered'] = payment_mode.default_date_prefered
-        return super(AccountPaymentOrder, self).create(vals)
+        return super(AccountPaymentOrder, self).create(vals_list)
 
     @api.onchange('payment_mode_id')
     def payment_mode_id_change(self):
@@ -209,11 +243,52 @@ class AccountPaymentOrder(models.Model):
 
     @api.multi
     def action_cancel(self):
-        for order in self:
-            order.write({'state': 'cancel'})
-            order.bank_line_ids.unlink()
+        # The bank payment lines are kept, so that confirming the order
+        # again keeps the ones whose group of payment lines is still valid
+        self.write({'state': 'cancel'})
         return True
 
+    @api.multi
+    def _queue_jobs(self, action):
+        """Queue a background job running the action for the orders that
+        have at least the number of payment lines set on their payment
+        mode
+        @return: the other orders, to process right away
+        """
+        if self.env.context.get('payment_order_job_id'):
+            return self
+        for order in self:
+            if order.job_active:
+                raise UserError(_(
+                    "The payment order %s is already being processed in "
+                    "the background.") % order.name)
+        queued_orders = self.filtered(
+            lambda order: order.payment_mode_id.background_threshold and
+            len(order.payment_line_ids) >=
+            order.payment_mode_id.background_threshold)
+        self.env['account.payment.order.job'].create([{
+            'order_id': order.id,
+            'action': action,
+            } for order in queued_orders])
+        for order in queued_orders:
+            order.message_post(body=_(
+                'The payment order will be processed in the background.'))
+        return self - queued_orders
+
+    @api.multi
+    def _create_bank_payment_lines(self, vals_list):
+        """Create the bank payment lines by chunks, reporting the progress
+        of the background job after each of them"""
+        bplo = self.env['bank.payment.line']
+        job = self.env['account.payment.order.job'].browse(
+            self.env.context.get('payment_order_job_id'))
+        for index in range(0, len(vals_list), BANK_LINE_CHUNK_SIZE):
+            bplo.create(vals_list[index:index + BANK_LINE_CHUNK_SIZE])
+            if job:
+                job._set_progress(
+                    100.0 * min(index + BANK_LINE_CHUNK_SIZE, len(vals_list))
+                    / len(vals_list))
+
     @api.model
     def _prepare_bank_payment_line(self, paylines):
         return {
@@ -223,17 +298,126 @@ class AccountPaymentOrder(models.Model):
                 [line.communication for line in paylines]),
             }
 
+    @api.multi
+    def _regroup_bank_payment_lines(self, paylines, payline_groups):
+        """
+        Match the groups of payment lines with the existing bank payment
+        lines of the order. A bank payment line whose payment lines are
+        all still in the same group is updated with that group and keeps
+        its reference, the other ones are deleted.
+        @param paylines: the payment lines of the order
+        @param payline_groups: list of lists of payment line ids
+        @return: list of the values of the bank payment lines to create
+        """
+        self.ensure_one()
+        group_per_payline = {}
+        for index, payline_ids in enumerate(payline_groups):
+            for payline_id in payline_ids:
+                group_per_payline[payline_id] = index
+        kept_bank_lines = {}  # key = group index
+        obsolete_bank_lines = self.env['bank.payment.line']
+        for bank_line in self.bank_line_ids:
+            indexes = {
+                group_per_payline.get(payline_id)
+                for payline_id in bank_line.payment_line_ids.ids}
+            index = indexes.pop() if len(indexes) == 1 else None
+            if index is None or index in kept_bank_lines:
+                obsolete_bank_lines |= bank_line
+            else:
+                kept_bank_lines[index] = bank_line
+        obsolete_bank_lines.unlink()
+        vals_list = []
+        for index, payline_ids in enumerate(payline_groups):
+            vals = self._prepare_bank_payment_line(
+                paylines.browse(payline_ids))
+            bank_line = kept_bank_lines.get(index)
+            if bank_line is None:
+                vals_list.append(vals)
+                continue
+            vals.pop('order_id', None)
+            if set(bank_line.payment_line_ids.ids) == set(payline_ids):
+                vals.pop('payment_line_ids', None)
+                if vals.get('communication') == bank_line.communication:
+                    vals.pop('communication')
+            if vals:
+                bank_line.write(vals)
+        return vals_list
+
+    @api.multi
+    def _plan_requested_dates(self):
+        """Compute the requested payment date of all the payment lines of
+        the order, without writing anything, so that it can also be used
+        to preview the confirmation of the order
+        @return: dict with the keys
+            'dates': {payment line id: requested date}
+            'violations': list of (payment line, requested date) that don't
+                respect the option 'Disallow Debit Before Maturity Date'
+        """
+        self.ensure_one()
+        today = fields.Date.context_today(self)
+        paylines = self.payment_line_ids
+        # One read of the maturity dates for all the lines
+        maturity_dates = {
+            payline.id: payline.ml_maturity_date for payline in paylines}
+        if self.date_prefered == 'fixed':
+            # No payment date in the past
+            default_date = max(self.date_scheduled or today, today)
+        else:
+            default_date = today
+        check_maturity = (
+            self.payment_type == 'inbound' and
+            self.payment_mode_id.no_debit_before_maturity)
+        dates = {}
+        violations = []
+        for payline in paylines:
+            maturity_date = maturity_dates[payline.id]
+            if self.date_prefered == 'due' and maturity_date:
+                requested_date = max(maturity_date, today)
+            else:
+                requested_date = default_date
+            if (
+                    check_maturity and maturity_date and
+                    requested_date < maturity_date):
+                violations.append((payline, requested_date))
+            dates[payline.id] = requested_date
+        return {'dates': dates, 'violations': violations}
+
+    @api.multi
+    def _format_requested_date_violations(self, violations):
+        self.ensure_one()
+        return _(
+            "The payment mode '%s' has the option "
+            "'Disallow Debit Before Maturity Date'. The following payment "
+            "lines have a maturity date which is after the computed "
+            "payment date:\n%s") % (
+                self.payment_mode_id.name,
+                '\n'.join(_(
+                    "- %s: maturity date %s, payment date %s") % (
+                        payline.name, payline.ml_maturity_date,
+                        requested_date)
+                    for payline, requested_date in violations))
+
+    @api.multi
+    def preview_requested_dates(self):
+        """Report the payment dates that the confirmation of the orders
+        would set, and the payment lines that would block it
+        @return: {order id: result of _plan_requested_dates()}
+        """
+        return {order.id: order._plan_requested_dates() for order in self}
+
     @api.multi
     def draft2open(self):
         """
         Called when you click on the 'Confirm' button
         Set the 'date' on payment line depending on the 'date_prefered'
         setting of the payment.order
-        Re-generate the bank payment lines
+        Re-generate the bank payment lines, keeping the existing ones whose
+        group of payment lines is still valid
+        Large orders are processed in a background job.
         """
-        bplo = self.env['bank.payment.line']
-        today = fields.Date.context_today(self)
-        for order in self:
+        orders = self._queue_jobs('draft2open')
+        bank_line_vals_list = []
+        for order in orders:
             if not order.journal_id:
                 raise UserError(_(
                     'Missing Bank Journal on payment order %s.') % order.name)
@@ -247,72 +431,63 @@ class AccountPaymentOrder(models.Model):
                 raise UserError(_(
                     'There are no transactions on payment order %s.')
                     % order.name)
-            # Delete existing bank payment lines
-            order.bank_line_ids.unlink()
-            # Create the bank payment lines from the payment lines
-            group_paylines = {}  # key = hashcode
-            for payline in order.payment_line_ids:
+            paylines = order.payment_line_ids
+            for payline in paylines:
                 payline.draft2open_payment_line_check()
-                # Compute requested payment date
-                if order.date_prefered == 'due':
-                    requested_date = payline.ml_maturity_date or today
-                elif order.date_prefered == 'fixed':
-                    requested_date = order.date_scheduled or today
-                else:
-                    requested_date = today
-                # No payment date in the past
-                if requested_date < today:
-                    requested_date = today
-                # inbound: check option no_debit_before_maturity
-                if (
-                        order.payment_type == 'inbound' and
-                        order.payment_mode_id.no_debit_before_maturity and
-                        payline.ml_maturity_date and
-                        requested_date < payline.ml_maturity_date):
-                    raise UserError(_(
-                        "The payment mode '%s' has the option "
-                        "'Disallow Debit Before Maturity Date'. The "
-                        "payment line %s has a maturity date %s "
-                        "which is after the computed payment date %s.") % (
-                            order.payment_mode_id.name,
-                            payline.name,
-                            payline.ml_maturity_date,
-                            requested_date))
-                # Write requested_date on 'date' field of payment line
-                # norecompute is for avoiding a chained recomputation
-                # payment_line_ids.date
-                # > payment_line_ids.amount_company_currency
-                # > total_company_currency
-                with self.env.norecompute():
-                    payline.date = requested_date
+            plan = order._plan_requested_dates()
+            if plan['violations']:
+                raise UserError(order._format_requested_date_violations(
+                    plan['violations']))
+            paylines_per_date = {}
+            for payline_id, requested_date in plan['dates'].items():
+                paylines_per_date.setdefault(requested_date, []).append(
+                    payline_id)
+            # Write requested_date on 'date' field of payment lines, with
+            # one write per date
+            # norecompute is for avoiding a chained recomputation
+            # payment_line_ids.date
+            # > payment_line_ids.amount_company_currency
+            # > total_company_currency
+            with self.env.norecompute():
+                for requested_date, payline_ids in paylines_per_date.items():
+                    paylines.browse(payline_ids).write(
+                        {'date': requested_date})
+            # Create the bank payment lines from the payment lines
+            group_paylines = {}  # key = grouping key
+            grouping_keys = {}
+            if order.payment_mode_id.group_lines:
+                grouping_keys = paylines._get_grouping_keys()
+            for payline in paylines:
                 # Group options
-                if order.payment_mode_id.group_lines:
-                    hashcode = payline.payment_line_hashcode()
-                else:
-                    # Use line ID as hascode, which actually means no grouping
-                    hashcode = payline.id
+                # Use line ID as key by default, which actually means no
+                # grouping
+                hashcode = grouping_keys.get(payline.id, payline.id)
                 if hashcode in group_paylines:
-                    group_paylines[hashcode]['paylines'] += payline
+                    group_paylines[hashcode]['payline_ids'].append(payline.id)
                     group_paylines[hashcode]['total'] +=\
                         payline.amount_currency
                 else:
                     group_paylines[hashcode] = {
-                        'paylines': payline,
+                        'payline_ids': [payline.id],
                         'total': payline.amount_currency,
                     }
             order.recompute()
-            # Create bank payment lines
             for paydict in list(group_paylines.values()):
                 # Block if a bank payment line is <= 0
                 if paydict['total'] <= 0:
+                    payline = paylines.browse(paydict['payline_ids'][0])
                     raise UserError(_(
                         "The amount for Partner '%s' is negative "
                         "or null (%.2f) !")
-                        % (paydict['paylines'][0].partner_id.name,
-                           paydict['total']))
-                vals = self._prepare_bank_payment_line(paydict['paylines'])
-                bplo.create(vals)
-        self.write({'state': 'open'})
+                        % (payline.partner_id.name, paydict['total']))
+            bank_line_vals_list += order._regroup_bank_payment_lines(
+                paylines, [
+                    paydict['payline_ids']
+                    for paydict in group_paylines.values()])
+        # Create all the bank payment lines at once, with their references
+        # reserved in one block
+        orders._create_bank_payment_lines(bank_line_vals_list)
+        orders.write({'state': 'open'})
         return True
 
     @api.multi
@@ -326,19 +501,31 @@ class AccountPaymentOrder(models.Model):
                 "No handler for this payment method. Maybe you haven't "
                 "installed the related Odoo module."))
 
+    @api.multi
+    def _prepare_payment_file_attachment_vals(self, payment_file_str,
+                                              filename):
+        self.ensure_one()
+        return {
+            'res_model': 'account.payment.order',
+            'res_id': self.id,
+            'name': filename,
+            'datas': base64.b64encode(payment_file_str),
+            'datas_fname': filename,
+            }
+
     @api.multi
     def open2generated(self):
         self.ensure_one()
+        if not self._queue_jobs('open2generated'):
+            return True
         payment_file_str, filename = self.generate_payment_file()
         action = {}
         if payment_file_str and filename:
-            attachment = self.env['ir.attachment'].create({
-                'res_model': 'account.payment.order',
-                'res_id': self.id,
-                'name': filename,
-                'datas': base64.b64encode(payment_file_str),
-                'datas_fname': filename,
-                })
+            vals = self._prepare_payment_file_attachment_vals(
+                payment_file_str, filename)
+            # Only the encoded copy is needed from now on
+            del payment_file_str
+            attachment = self.env['ir.attachment'].create(vals)
             simplified_form_view = self.env.ref(
                 'account_payment_order.view_attachment_simplified_form')
             action = {
@@ -359,10 +546,11 @@ class AccountPaymentOrder(models.Model):
 
     @api.multi
     def generated2uploaded(self):
-        for order in self:
+        orders = self._queue_jobs('generated2uploaded')
+        for order in orders:
             if order.payment_mode_id.generate_move:
                 order.generate_move()
-        self.write({
+        orders.write({
             'state': 'uploaded',
             'date_uploaded': fields.Date.context_today(self),
             })
@@ -475,42 +663,64 @@ class AccountPaymentOrder(models.Model):
                 })
         return vals
 
-    @api.multi
-    def _create_reconcile_move(self, hashcode, blines):
-        self.ensure_one()
-        post_move = self.payment_mode_id.post_move
-        am_obj = self.env['account.move']
-        mvals = self._prepare_move(blines)
-        move = am_obj.create(mvals)
-        blines.reconcile_payment_lines()
-        if post_move:
-            move.post()
-
     @api.multi
     def _prepare_trf_moves(self):
         """
         prepare a dict "trfmoves" that can be used when
         self.payment_mode_id.move_option = date or line
-        key = unique identifier (date or True or line.id)
+        key = tuple returned by _get_move_line_offsetting_account_keys()
+        (date or line.id), where it used to be the string returned by
+        move_line_offsetting_account_hashcode()
         value = bank_pay_lines (recordset that can have several entries)
         """
         self.ensure_one()
-        trfmoves = {}
+        bline_ids_per_key = {}
+        keys = self.bank_line_ids._get_move_line_offsetting_account_keys()
         for bline in self.bank_line_ids:
-            hashcode = bline.move_line_offsetting_account_hashcode()
-            if hashcode in trfmoves:
-                trfmoves[hashcode] += bline
-            else:
-                trfmoves[hashcode] = bline
-        return trfmoves
+            bline_ids_per_key.setdefault(keys[bline.id], []).append(bline.id)
+        return {
+            hashcode: self.bank_line_ids.browse(bline_ids)
+            for hashcode, bline_ids in bline_ids_per_key.items()}
 
     @api.multi
     def generate_move(self):
         """
         Create the moves that pay off the move lines from
         the payment/debit order.
+        All the moves are created at once, then the bank payment lines
+        are reconciled and the moves posted together, unless an installed
+        module overrides _create_reconcile_move(), which is then called
+        for each move.
         """
         self.ensure_one()
         trfmoves = self._prepare_trf_moves()
-        for hashcode, blines in trfmoves.items():
-            self._create_reconcile_move(hashcode, blines)
+        if type(self)._create_reconcile_move is not \
+                AccountPaymentOrder._create_reconcile_move:
+            bplo = self.env['bank.payment.line']
+            for key, blines in trfmoves.items():
+                # The string hashcode it used to be called with
+                self._create_reconcile_move(
+                    bplo._offsetting_account_key_to_hashcode(key), blines)
+            return
+        moves = self.env['account.move'].create([
+            self._prepare_move(blines) for blines in trfmoves.values()])
+        self.bank_line_ids.reconcile_payment_lines()
+        if self.payment_mode_id.post_move:
+            moves.post()
+
+    @api.multi
+    def _create_reconcile_move(self, hashcode, blines):
+        """Create, reconcile and post the move of a group of bank payment
+        lines. Deprecated: generate_move() does it for all the groups at
+        once, and only calls this method when it is overridden.
+        @param hashcode: the key of the group in _prepare_trf_moves(), as
+            a string like move_line_offsetting_account_hashcode() returns
+        """
+        self.ensure_one()
+        post_move = self.payment_mode_id.post_move
+        am_obj = self.env['account.move']
+        mvals = self._prepare_move(blines)
+        move = am_obj.create(mvals)
+        blines.reconcile_payment_lines()
+        if post_move:
+            move.post()
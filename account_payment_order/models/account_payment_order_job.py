@@ -0,0 +1,189 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# First key of the PostgreSQL advisory locks taken on the payment orders
+# while a job runs, the second one being the id of the order
+PAYMENT_ORDER_JOB_LOCK = 726901
+
+# State the payment order must be in for the action of a job to run
+ACTION_SOURCE_STATES = {
+    'draft2open': 'draft',
+    'open2generated': 'open',
+    'generated2uploaded': 'generated',
+    }
+
+
+class AccountPaymentOrderJob(models.Model):
+    _name = 'account.payment.order.job'
+    _description = 'Payment Order Background Job'
+    _order = 'id desc'
+
+    order_id = fields.Many2one(
+        'account.payment.order', string='Payment Order', required=True,
+        ondelete='cascade', index=True, readonly=True)
+    action = fields.Selection([
+        ('draft2open', 'Confirm Payments'),
+        ('open2generated', 'Generate Payment File'),
+        ('generated2uploaded', 'File Successfully Uploaded'),
+        ], string='Action', required=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ], string='Status', required=True, default='pending', readonly=True,
+        index=True)
+    progress = fields.Float(string='Progress (%)', readonly=True)
+    attempt_count = fields.Integer(string='Attempts', readonly=True)
+    user_id = fields.Many2one(
+        'res.users', string='Requested by', required=True, readonly=True,
+        default=lambda self: self.env.user)
+    date_started = fields.Datetime(string='Started on', readonly=True)
+    date_finished = fields.Datetime(string='Finished on', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    @api.model_cr
+    def init(self):
+        # Only one job waiting or running per payment order
+        self._cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS
+            account_payment_order_job_active_order_uniq
+            ON account_payment_order_job (order_id)
+            WHERE state IN ('pending', 'running')""")
+
+    @api.multi
+    def _try_lock(self):
+        """Take the advisory lock of the payment order of the job, for the
+        session of the cursor, so that it survives the commit of the job
+        and is released if the worker dies"""
+        self.ensure_one()
+        self._cr.execute(
+            "SELECT pg_try_advisory_lock(%s, %s)",
+            (PAYMENT_ORDER_JOB_LOCK, self.order_id.id))
+        return self._cr.fetchone()[0]
+
+    @api.multi
+    def _unlock(self):
+        self.ensure_one()
+        self._cr.execute(
+            "SELECT pg_advisory_unlock(%s, %s)",
+            (PAYMENT_ORDER_JOB_LOCK, self.order_id.id))
+
+    @api.multi
+    def _set_status(self, vals):
+        """Write the status of the job. In the cron, it is written through
+        a separate cursor, so that it is visible right away while the
+        changes of the payment order stay in the transaction of the job"""
+        self.ensure_one()
+        if self.env.context.get('payment_order_job_commit'):
+            with self.pool.cursor() as cr:
+                self.with_env(self.env(cr=cr)).write(vals)
+            self.invalidate_cache(list(vals), self.ids)
+        else:
+            self.write(vals)
+
+    @api.multi
+    def _set_progress(self, progress):
+        self.ensure_one()
+        self._set_status({'progress': progress})
+
+    @api.multi
+    def _run(self, commit=True):
+        """Run the action of the job on its payment order, as the user who
+        requested it, in a savepoint
+        @param commit: commit the changes of the job before marking it as
+            done, as done by the cron
+        @return: False if the payment order is locked by another job
+        """
+        self.ensure_one()
+        if not self._try_lock():
+            return False
+        job = self.with_context(payment_order_job_commit=commit)
+        try:
+            # The order may have been processed in the meantime, e.g. by a
+            # worker that died after committing the changes of the job
+            state = self.order_id.state
+            if state != ACTION_SOURCE_STATES[self.action]:
+                logger.info(
+                    "Background job %s skipped, as payment order %s is in "
+                    "state %s", self.action, self.order_id.name, state)
+                job._set_status({
+                    'state': 'done',
+                    'date_finished': fields.Datetime.now(),
+                    })
+                return True
+            job._set_status({
+                'state': 'running',
+                'date_started': fields.Datetime.now(),
+                'attempt_count': self.attempt_count + 1,
+                })
+            order = self.order_id.sudo(self.user_id).with_context(
+                payment_order_job_id=self.id,
+                payment_order_job_commit=commit)
+            try:
+                with self._cr.savepoint():
+                    getattr(order, self.action)()
+            except Exception as e:
+                logger.exception(
+                    "Background job %s on payment order %s failed",
+                    self.action, self.order_id.name)
+                self.env.clear()
+                job._set_status({
+                    'state': 'failed',
+                    'date_finished': fields.Datetime.now(),
+                    'error': str(e),
+                    })
+                return True
+            if commit:
+                # The changes of the payment order are committed as a
+                # whole, before the job is marked as done through another
+                # cursor, so that a job is never done without its changes
+                self._cr.commit()  # pylint: disable=invalid-commit
+            job._set_status({
+                'state': 'done',
+                'progress': 100.0,
+                'date_finished': fields.Datetime.now(),
+                })
+        finally:
+            self._unlock()
+        return True
+
+    @api.model
+    def _cron_run_jobs(self):
+        """Run the pending jobs, and run again from the start the running
+        jobs whose payment order isn't locked anymore, i.e. whose worker
+        died before committing their changes"""
+        jobs = self.search(
+            [('state', 'in', ('pending', 'running'))], order='id')
+        for job in jobs:
+            job._run()
+
+    @api.multi
+    def retry(self):
+        jobs = self.filtered(lambda job: job.state == 'failed')
+        orders = self.env['account.payment.order']
+        for job in jobs:
+            if job.order_id.job_active or job.order_id in orders:
+                raise UserError(_(
+                    "The payment order %s is already being processed in "
+                    "the background.") % job.order_id.name)
+            orders |= job.order_id
+        jobs.write({
+            'state': 'pending',
+            'error': False,
+            })
+        return True
+
+    @api.multi
+    def name_get(self):
+        actions = dict(self._fields['action']._description_selection(
+            self.env))
+        return [
+            (job.id, _('%s on %s') % (actions[job.action], job.order_id.name))
+            for job in self]
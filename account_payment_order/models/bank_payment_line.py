@@ -2,6 +2,8 @@
 # Copyright 2018 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+from datetime import date
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 
@@ -74,44 +76,105 @@ class BankPaymentLine(models.Model):
         return same_fields
 
     @api.multi
-    @api.depends('payment_line_ids', 'payment_line_ids.amount_currency')
+    @api.depends(
+        'payment_line_ids', 'payment_line_ids.amount_currency',
+        'payment_line_ids.date')
     def _compute_amount(self):
+        # The amounts of the saved bank lines are summed with one SQL
+        # aggregation
+        sql_blines = self.filtered(
+            lambda bline: not isinstance(bline.id, models.NewId))
+        amounts = self.env['account.payment.line']._sum_per_group(
+            'amount_currency', 'bank_line_id', sql_blines.ids)
+        amounts_currency = []
         for bline in self:
-            amount_currency = sum(
-                bline.mapped('payment_line_ids.amount_currency'))
-            amount_company_currency = bline.currency_id._convert(
-                amount_currency, bline.company_currency_id, bline.company_id,
-                bline.date or fields.Date.today(),
-            )
+            if bline.id in amounts:
+                amounts_currency.append(amounts[bline.id])
+            else:
+                amounts_currency.append(sum(
+                    bline.mapped('payment_line_ids.amount_currency')))
+        today = fields.Date.today()
+        amounts_company_currency = self.env['res.currency']._convert_batch([(
+            amount_currency, bline.currency_id, bline.company_currency_id,
+            bline.company_id, bline.date or today)
+            for bline, amount_currency in zip(self, amounts_currency)])
+        for bline, amount_currency, amount_company_currency in zip(
+                self, amounts_currency, amounts_company_currency):
             bline.amount_currency = amount_currency
             bline.amount_company_currency = amount_company_currency
 
-    @api.model
-    @api.returns('self')
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code(
-                'bank.payment.line') or 'New'
-        return super(BankPaymentLine, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        vals_to_name = [
+            vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        names = self.env['ir.sequence'].next_by_code_batch(
+            'bank.payment.line', len(vals_to_name))
+        for vals, name in zip(vals_to_name, names):
+            vals['name'] = name or 'New'
+        return super(BankPaymentLine, self).create(vals_list)
 
     @api.multi
-    def move_line_offsetting_account_hashcode(self):
+    def _get_move_line_offsetting_account_keys(self):
         """
+        Return the keys the bank payment lines are grouped by in transfer
+        moves, for the whole recordset in one pass
         This method is inherited in the module
         account_banking_sepa_direct_debit
+        If an installed module still overrides
+        move_line_offsetting_account_hashcode(), the keys are its hashcodes.
+        @return: dict {bank payment line id: tuple of plain values}
         """
+        if type(self).move_line_offsetting_account_hashcode is not \
+                BankPaymentLine.move_line_offsetting_account_hashcode and \
+                not self.env.context.get('skip_deprecated_hashcode'):
+            return {
+                bline.id: (bline.move_line_offsetting_account_hashcode(), )
+                for bline in self}
+        return self._get_default_move_line_offsetting_account_keys()
+
+    @api.multi
+    def _get_default_move_line_offsetting_account_keys(self):
+        keys = {}
+        for bline in self:
+            if bline.order_id.payment_mode_id.move_option == 'date':
+                keys[bline.id] = (bline.date, )
+            else:
+                keys[bline.id] = (bline.id, )
+        return keys
+
+    @api.multi
+    def move_line_offsetting_account_hashcode(self):
+        """Deprecated: inherit _get_move_line_offsetting_account_keys()
+        instead, which groups the whole recordset in one pass. Still
+        called for each line when it is overridden."""
         self.ensure_one()
-        if self.order_id.payment_mode_id.move_option == 'date':
-            hashcode = fields.Date.to_string(self.date)
-        else:
-            hashcode = str(self.id)
-        return hashcode
+        key = self.with_context(skip_deprecated_hashcode=True).\
+            _get_move_line_offsetting_account_keys()[self.id]
+        return self._offsetting_account_key_to_hashcode(key)
+
+    @api.model
+    def _offsetting_account_key_to_hashcode(self, key):
+        """Return the string hashcode of a key of
+        _get_move_line_offsetting_account_keys(), as
+        move_line_offsetting_account_hashcode() used to"""
+        return '-'.join(
+            fields.Date.to_string(value) if isinstance(value, date)
+            else str(value) for value in key)
 
     @api.multi
     def reconcile_payment_lines(self):
+        # The transit move lines of all the bank payment lines are read at
+        # once
+        transit_mline_ids = {}
+        for mline in self.env['account.move.line'].search([
+                ('bank_payment_line_id', 'in', self.ids)]):
+            transit_mline_ids.setdefault(
+                mline.bank_payment_line_id.id, []).append(mline.id)
+        amlo = self.env['account.move.line']
         for bline in self:
             if all([pline.move_line_id for pline in bline.payment_line_ids]):
-                bline.reconcile()
+                bline.reconcile(transit_mlines=amlo.browse(
+                    transit_mline_ids.get(bline.id, [])))
             else:
                 bline.no_reconcile_hook()
 
@@ -121,10 +184,16 @@ class BankPaymentLine(models.Model):
         return
 
     @api.multi
-    def reconcile(self):
+    def reconcile(self, transit_mlines=None):
+        """
+        @param transit_mlines: the move lines of the transfer move linked
+            to the bank payment line, searched if not given
+        """
         self.ensure_one()
         amlo = self.env['account.move.line']
-        transit_mlines = amlo.search([('bank_payment_line_id', '=', self.id)])
+        if transit_mlines is None:
+            transit_mlines = amlo.search(
+                [('bank_payment_line_id', '=', self.id)])
         assert len(transit_mlines) == 1, 'We should have only 1 move'
         transit_mline = transit_mlines[0]
         assert not transit_mline.reconciled,\
@@ -0,0 +1,38 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import models, api
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    @api.model
+    def _convert_batch(self, conversions):
+        """Batch counterpart of _convert(): the conversions are grouped by
+        (from currency, to currency, company, date), and the rate of each
+        group is looked up once for all its amounts
+        @param conversions: list of tuples
+            (amount, from currency, to currency, company, date)
+        @return: list of the converted amounts, rounded in the target
+            currency, in the order of conversions
+        """
+        # As in _convert(), a missing currency is the other one
+        conversions = [
+            (amount, from_cur or to_cur, to_cur or from_cur, company, date)
+            for amount, from_cur, to_cur, company, date in conversions]
+        groups = {}
+        for index, (amount, from_cur, to_cur, company, date) in enumerate(
+                conversions):
+            key = (from_cur.id, to_cur.id, company.id, date)
+            groups.setdefault(key, []).append(index)
+        res = [0.0] * len(conversions)
+        for indexes in groups.values():
+            amount, from_cur, to_cur, company, date = conversions[indexes[0]]
+            if from_cur == to_cur:
+                rate = 1.0
+            else:
+                rate = self._get_conversion_rate(
+                    from_cur, to_cur, company, date)
+            for index in indexes:
+                res[index] = to_cur.round(conversions[index][0] * rate)
+        return res
@@ -122,3 +122,25 @@ class TestPaymentOrderInbound(TestPaymentOrderInboundBase):
         payment_order.cancel2draft()
         payment_order.unlink()
         self.assertEqual(len(self.payment_order_obj.search(self.domain)), 0)
+
+    def test_requested_date_violations(self):
+        payment_order = self.inbound_order
+        payline = payment_order.payment_line_ids
+        maturity_date = date.today() + timedelta(days=10)
+        payline.move_line_id.date_maturity = maturity_date
+        payline_date = payline.date
+        self.inbound_mode.no_debit_before_maturity = True
+        payment_order.date_prefered = 'now'
+        plan = payment_order.preview_requested_dates()[payment_order.id]
+        self.assertEqual(plan['dates'], {payline.id: date.today()})
+        self.assertEqual(plan['violations'], [(payline, date.today())])
+        # The preview doesn't write anything
+        self.assertEqual(payline.date, payline_date)
+        with self.assertRaises(UserError):
+            payment_order.draft2open()
+        payment_order.date_prefered = 'due'
+        plan = payment_order.preview_requested_dates()[payment_order.id]
+        self.assertEqual(plan['dates'], {payline.id: maturity_date})
+        self.assertFalse(plan['violations'])
+        payment_order.draft2open()
+        self.assertEqual(payline.date, maturity_date)
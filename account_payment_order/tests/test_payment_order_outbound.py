@@ -140,9 +140,15 @@ class TestPaymentOrderOutbound(SavepointCase):
         line_created_due.populate()
         line_created_due.create_payment_lines()
         self.assertGreater(len(order.payment_line_ids), 0)
+        move_lines = order.payment_line_ids.mapped('move_line_id')
+        self.assertTrue(all(move_lines.mapped('in_pending_payment_order')))
+        self.assertFalse(
+            move_lines & self.env['account.move.line'].search(
+                line_created_due._prepare_move_line_domain()))
         order.draft2open()
         order.open2generated()
         order.generated2uploaded()
+        self.assertFalse(any(move_lines.mapped('in_pending_payment_order')))
         order.action_done()
         self.assertEqual(order.state, 'done')
 
@@ -192,6 +198,209 @@ class TestPaymentOrderOutbound(SavepointCase):
             len(self.env['account.payment.order'].search(self.domain)), 0,
         )
 
+    def test_draft2open_keeps_bank_lines(self):
+        self.invoice.action_invoice_open()
+        self.env['account.invoice.payment.line.multi'].with_context(
+            active_model='account.invoice',
+            active_ids=self.invoice.ids
+        ).create({}).run()
+        payment_order = self.env['account.payment.order'].search(self.domain)
+        payment_order.write({
+            'journal_id': self.bank_journal.id,
+        })
+        payment_order.draft2open()
+        bank_line = payment_order.bank_line_ids
+        self.assertEqual(len(bank_line), 1)
+        # Confirming again keeps the bank payment line and its reference
+        payment_order.action_cancel()
+        self.assertEqual(payment_order.bank_line_ids, bank_line)
+        payment_order.cancel2draft()
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_ids, bank_line)
+        # A changed group of payment lines is updated in place
+        payment_line = payment_order.payment_line_ids
+        payment_order.action_cancel()
+        payment_order.cancel2draft()
+        payment_line.communication = 'Changed'
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_ids, bank_line)
+        self.assertEqual(bank_line.communication, 'Changed')
+
+    def test_payment_line_create_select_all(self):
+        self.invoice.action_invoice_open()
+        order = self.env['account.payment.order'].create({
+            'payment_type': 'outbound',
+            'payment_mode_id': self.mode.id,
+            'journal_id': self.bank_journal.id,
+        })
+        line_create = self.env['account.payment.line.create'].with_context(
+            active_model='account.payment.order',
+            active_id=order.id
+        ).create({
+            'date_type': 'move',
+            'move_date': datetime.now(),
+            'payment_mode': 'any',
+            'select_all': True,
+        })
+        matching_lines = self.env['account.move.line'].search(
+            line_create._prepare_move_line_domain())
+        self.assertTrue(matching_lines)
+        self.assertEqual(line_create.move_line_count, len(matching_lines))
+        line_create.populate()
+        self.assertFalse(line_create.move_line_ids)
+        chunks = list(line_create._iter_selected_move_lines(chunk_size=1))
+        self.assertEqual(len(chunks), len(matching_lines))
+        line_create.excluded_move_line_ids = matching_lines[0]
+        line_create.create_payment_lines()
+        self.assertEqual(
+            order.payment_line_ids.mapped('move_line_id'),
+            matching_lines - matching_lines[0])
+
+    def test_create_account_payment_line_multi(self):
+        invoices = self.invoice | self.invoice_02
+        invoices.action_invoice_open()
+        action = invoices.create_account_payment_line()
+        payment_order = self.env['account.payment.order'].search(self.domain)
+        self.assertEqual(len(payment_order), 1)
+        self.assertEqual(action['res_id'], payment_order.id)
+        self.assertEqual(
+            payment_order.payment_line_ids.mapped('move_line_id.invoice_id'),
+            invoices)
+        # Only the first invoice created the order
+        self.assertIn(
+            'automatically created', self.invoice.message_ids[0].body)
+        self.assertIn(
+            'existing draft payment order',
+            self.invoice_02.message_ids[0].body)
+        # The move lines are already in a draft payment order
+        with self.assertRaises(UserError):
+            self.invoice.create_account_payment_line()
+
+    def test_totals(self):
+        invoices = self.invoice | self.invoice_02
+        invoices.action_invoice_open()
+        invoices.create_account_payment_line()
+        payment_order = self.env['account.payment.order'].search(self.domain)
+        payment_order.journal_id = self.bank_journal
+        paylines = payment_order.payment_line_ids
+        self.assertEqual(len(paylines), 2)
+        self.assertAlmostEqual(
+            payment_order.total_company_currency,
+            sum(paylines.mapped('amount_company_currency')))
+        # Each change of amount is counted once in the total
+        payline = paylines[0]
+        for _i in range(2):
+            payline.amount_currency += 10.0
+            payment_order.invalidate_cache()
+            self.assertAlmostEqual(
+                payment_order.total_company_currency,
+                sum(paylines.mapped('amount_company_currency')))
+        payment_order.draft2open()
+        self.assertAlmostEqual(
+            sum(payment_order.bank_line_ids.mapped('amount_currency')),
+            sum(paylines.mapped('amount_currency')))
+
+    def test_convert_batch(self):
+        company = self.env.user.company_id
+        currency = self.env.ref('base.USD')
+        if currency == company.currency_id:
+            currency = self.env.ref('base.EUR')
+        self.env['res.currency.rate'].create({
+            'currency_id': currency.id,
+            'company_id': company.id,
+            'rate': 1.5,
+        })
+        today = date.today()
+        conversions = [
+            (10.0, currency, company.currency_id, company, today),
+            (20.0, company.currency_id, company.currency_id, company, today),
+            (30.0, currency, company.currency_id, company, today),
+            ]
+        self.assertEqual(
+            self.env['res.currency']._convert_batch(conversions),
+            [from_currency._convert(amount, to_currency, company, day)
+             for amount, from_currency, to_currency, company, day
+             in conversions])
+
+    def test_background_job(self):
+        self.invoice.action_invoice_open()
+        self.env['account.invoice.payment.line.multi'].with_context(
+            active_model='account.invoice',
+            active_ids=self.invoice.ids
+        ).create({}).run()
+        payment_order = self.env['account.payment.order'].search(self.domain)
+        payment_order.write({
+            'journal_id': self.bank_journal.id,
+        })
+        self.mode.background_threshold = 1
+        payment_order.draft2open()
+        self.assertEqual(payment_order.state, 'draft')
+        job = payment_order.job_ids
+        self.assertEqual((job.action, job.state), ('draft2open', 'pending'))
+        self.assertTrue(payment_order.job_active)
+        with self.assertRaises(UserError):
+            payment_order.draft2open()
+        job._run(commit=False)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(payment_order.state, 'open')
+        self.assertEqual(payment_order.bank_line_count, 1)
+        self.assertFalse(payment_order.job_active)
+
+    def test_background_job_skipped(self):
+        self.invoice.action_invoice_open()
+        self.env['account.invoice.payment.line.multi'].with_context(
+            active_model='account.invoice',
+            active_ids=self.invoice.ids
+        ).create({}).run()
+        payment_order = self.env['account.payment.order'].search(self.domain)
+        payment_order.write({
+            'journal_id': self.bank_journal.id,
+        })
+        self.mode.background_threshold = 1
+        payment_order.draft2open()
+        job = payment_order.job_ids
+        # The order was confirmed in the meantime
+        payment_order.with_context(payment_order_job_id=job.id).draft2open()
+        self.assertEqual(payment_order.state, 'open')
+        bank_line = payment_order.bank_line_ids
+        job._run(commit=False)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.attempt_count, 0)
+        self.assertEqual(payment_order.bank_line_ids, bank_line)
+        # A failed job is retried only if no other job is active
+        job.state = 'failed'
+        other_job = job.copy({'state': 'failed'})
+        with self.assertRaises(UserError):
+            (job | other_job).retry()
+        payment_order.action_cancel()
+        payment_order.cancel2draft()
+        # Queues a new job
+        payment_order.draft2open()
+        self.assertTrue(payment_order.job_active)
+        with self.assertRaises(UserError):
+            job.retry()
+        self.assertEqual(job.state, 'failed')
+
+    def test_next_by_code_batch(self):
+        sequence_model = self.env['ir.sequence']
+        for implementation in ('standard', 'no_gap'):
+            sequence = sequence_model.create({
+                'name': 'Test batch',
+                'code': 'test.payment.batch.%s' % implementation,
+                'implementation': implementation,
+                'prefix': 'TB/',
+                'padding': 4,
+            })
+            names = sequence_model.next_by_code_batch(sequence.code, 3)
+            self.assertEqual(names, ['TB/0001', 'TB/0002', 'TB/0003'])
+            self.assertEqual(
+                sequence_model.next_by_code(sequence.code), 'TB/0004')
+        self.assertEqual(
+            sequence_model.next_by_code_batch('test.payment.none', 2),
+            [False, False])
+        self.assertEqual(
+            sequence_model.next_by_code_batch(sequence.code, 0), [])
+
     def test_constrains(self):
         outbound_order = self.env['account.payment.order'].create({
             'payment_type': 'outbound',
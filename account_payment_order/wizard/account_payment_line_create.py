@@ -7,6 +7,10 @@
 
 from odoo import models, fields, api, _
 
+# Number of move lines turned into payment lines at once when all the
+# matching move lines are selected
+MOVE_LINE_CHUNK_SIZE = 1000
+
 
 class AccountPaymentLineCreate(models.TransientModel):
     _name = 'account.payment.line.create'
@@ -40,6 +44,18 @@ class AccountPaymentLineCreate(models.TransientModel):
         ], string='Payment Mode')
     move_line_ids = fields.Many2many(
         'account.move.line', string='Move Lines')
+    select_all = fields.Boolean(
+        string='All Matching Move Lines',
+        help="Create transactions from all the move lines matching the "
+        "criteria when the wizard is validated, instead of listing them "
+        "in the wizard. Recommended when there are many move lines.")
+    excluded_move_line_ids = fields.Many2many(
+        'account.move.line',
+        relation='account_payment_line_create_excluded_move_line_rel',
+        column1='wizard_id', column2='move_line_id',
+        string='Excluded Move Lines')
+    move_line_count = fields.Integer(
+        compute='_compute_move_line_count', string='Matching Move Lines')
 
     @api.model
     def default_get(self, field_list):
@@ -60,6 +76,20 @@ class AccountPaymentLineCreate(models.TransientModel):
             })
         return res
 
+    @api.multi
+    @api.depends(
+        'select_all', 'excluded_move_line_ids', 'date_type', 'move_date',
+        'due_date', 'journal_ids', 'invoice', 'target_move', 'allow_blocked',
+        'payment_mode', 'partner_ids')
+    def _compute_move_line_count(self):
+        amlo = self.env['account.move.line']
+        for wizard in self:
+            if wizard.select_all and wizard.order_id:
+                wizard.move_line_count = amlo.search_count(
+                    wizard._prepare_selected_move_line_domain())
+            else:
+                wizard.move_line_count = 0
+
     @api.multi
     def _prepare_move_line_domain(self):
         self.ensure_one()
@@ -113,19 +143,48 @@ class AccountPaymentLineCreate(models.TransientModel):
         # Exclude lines that are already in a non-cancelled
         # and non-uploaded payment order; lines that are in a
         # uploaded payment order are proposed if they are not reconciled,
-        paylines = self.env['account.payment.line'].search([
-            ('state', 'in', ('draft', 'open', 'generated')),
-            ('move_line_id', '!=', False)])
-        if paylines:
-            move_lines_ids = [payline.move_line_id.id for payline in paylines]
-            domain += [('id', 'not in', move_lines_ids)]
+        domain.append(('in_pending_payment_order', '=', False))
         return domain
 
     @api.multi
-    def populate(self):
+    def _prepare_selected_move_line_domain(self):
+        """Domain of the move lines selected with 'select_all'"""
+        self.ensure_one()
         domain = self._prepare_move_line_domain()
-        lines = self.env['account.move.line'].search(domain)
-        self.move_line_ids = lines
+        if self.excluded_move_line_ids:
+            domain.append(
+                ('id', 'not in', self.excluded_move_line_ids.ids))
+        return domain
+
+    @api.multi
+    def _iter_selected_move_lines(self, chunk_size=MOVE_LINE_CHUNK_SIZE):
+        """Yield the move lines selected with 'select_all' by chunks,
+        paginated on their id, so that they are never all loaded at once"""
+        self.ensure_one()
+        amlo = self.env['account.move.line']
+        domain = self._prepare_selected_move_line_domain()
+        last_id = 0
+        while True:
+            lines = amlo.search(
+                domain + [('id', '>', last_id)], order='id',
+                limit=chunk_size)
+            if not lines:
+                return
+            last_id = lines.ids[-1]
+            yield lines
+            if len(lines) < chunk_size:
+                return
+
+    @api.multi
+    def populate(self):
+        if self.select_all:
+            # The matching move lines are only fetched when the wizard is
+            # validated
+            self.move_line_ids = False
+        else:
+            domain = self._prepare_move_line_domain()
+            lines = self.env['account.move.line'].search(domain)
+            self.move_line_ids = lines
         action = {
             'name': _('Select Move Lines to Create Transactions'),
             'type': 'ir.actions.act_window',
@@ -142,12 +201,18 @@ class AccountPaymentLineCreate(models.TransientModel):
         'target_move', 'allow_blocked', 'payment_mode', 'partner_ids')
     def move_line_filters_change(self):
         domain = self._prepare_move_line_domain()
-        res = {'domain': {'move_line_ids': domain}}
+        res = {'domain': {
+            'move_line_ids': domain,
+            'excluded_move_line_ids': domain,
+            }}
         return res
 
     @api.multi
     def create_payment_lines(self):
-        if self.move_line_ids:
+        if self.select_all:
+            for lines in self._iter_selected_move_lines():
+                lines.create_payment_line_from_move_line(self.order_id)
+        elif self.move_line_ids:
             self.move_line_ids.create_payment_line_from_move_line(
                 self.order_id)
         return True